@@ -5,7 +5,6 @@ import threading
 from pathlib import Path
 import json
 import logging
-import subprocess
 
 from asset_manager import AssetManager
 from story_analyzer import StoryAnalyzer
@@ -13,6 +12,9 @@ from asset_generator import AssetGenerator
 from scene_composer import SceneComposer
 from scene_movement_analyzer import SceneMovementAnalyzer
 from video_processor import VideoProcessor
+from video_encoder import DEFAULT_ASPECTS, DEFAULT_PROFILE, ENCODING_PROFILES, VideoEncoder
+from ffmpeg_runner import FFmpegRunner
+from render_plan import RenderPlan
 from narration_generator import NarrationGenerator  # Assuming implemented
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
@@ -27,6 +29,7 @@ current_run_id = None
 
 generation_mode = "prompt"
 scene_count = "auto"
+encoding_profile = DEFAULT_PROFILE
 
 def get_runs():
     runs = sorted(Path("output").glob("run_*"))
@@ -94,6 +97,9 @@ def run_data(run_id):
         svg_dir = scenes_dir / "svg"
         if video_with_sound_dir.exists():
             for video_file in video_with_sound_dir.glob("*.mp4"):
+                # Cropped aspect variants belong to the scene of the square video
+                if any(aspect.suffix and video_file.stem.endswith(aspect.suffix) for aspect in DEFAULT_ASPECTS):
+                    continue
                 sid = video_file.stem.replace("scene_","")
                 scene_audio = audio_dir / f"scene_{sid}.mp3"
                 scene_svg = svg_dir / f"scene_{sid}.svg"
@@ -134,11 +140,12 @@ def serve_file():
 def index():
     return render_template('index.html')
 
-def start_pipeline(story_text_local, generation_mode_local, scene_count_local):
+def start_pipeline(story_text_local, generation_mode_local, scene_count_local, profile_local=DEFAULT_PROFILE):
     loop = asyncio.new_event_loop()
     asyncio.set_event_loop(loop)
     try:
-        final_path = loop.run_until_complete(run_pipeline(story_text_local, generation_mode_local, scene_count_local))
+        final_path = loop.run_until_complete(run_pipeline(story_text_local, generation_mode_local, scene_count_local,
+                                                          profile=profile_local))
         if final_path:
             logger.info(f"Pipeline complete. Final video: {final_path}")
         else:
@@ -151,19 +158,25 @@ def start_pipeline(story_text_local, generation_mode_local, scene_count_local):
 def generate():
     title = request.form['title']
     description = request.form['description']
-    global story_text, generation_mode, scene_count
+    global story_text, generation_mode, scene_count, encoding_profile
     generation_mode = request.form.get('generation_mode', 'prompt')
     scene_count = request.form.get('scene_count', 'auto')
+    profile = request.form.get('profile', DEFAULT_PROFILE)
+    if profile not in ENCODING_PROFILES:
+        return jsonify({"status": "error", "error": f"Unknown encoding profile: {profile}"}), 400
+    encoding_profile = profile
 
     story_text = f"{title}\n\n{description}"
 
     progress["step"] = "Starting..."
-    t = threading.Thread(target=start_pipeline, args=(story_text, generation_mode, scene_count))
+    t = threading.Thread(target=start_pipeline, args=(story_text, generation_mode, scene_count, encoding_profile))
     t.start()
 
     return jsonify({"status": "started"})
 
-async def run_pipeline(story_text_local, generation_mode_local, scene_count_local):
+async def run_pipeline(story_text_local, generation_mode_local, scene_count_local, max_workers=None,
+                       segments_per_scene=None, compositor_threads=1, aspects=DEFAULT_ASPECTS,
+                       profile=DEFAULT_PROFILE):
     asset_manager = AssetManager()
     global current_run_id
     current_run_id = asset_manager.run_id
@@ -171,7 +184,11 @@ async def run_pipeline(story_text_local, generation_mode_local, scene_count_loca
     story_analyzer = StoryAnalyzer(generation_mode=generation_mode_local, scene_count=scene_count_local)
     asset_generator = AssetGenerator(asset_manager=asset_manager)
     movement_analyzer = SceneMovementAnalyzer()
-    scene_composer = SceneComposer(asset_manager)
+    # Every ffmpeg step outside the scene encodes shares one runner (bounded concurrency)
+    ffmpeg_runner = FFmpegRunner()
+    scene_composer = SceneComposer(asset_manager, max_workers=max_workers, segments_per_scene=segments_per_scene,
+                                   compositor_threads=compositor_threads, aspects=aspects,
+                                   ffmpeg_runner=ffmpeg_runner, profile=profile)
     video_processor = VideoProcessor(asset_manager)
     narration_gen = NarrationGenerator(asset_manager=asset_manager)
 
@@ -216,43 +233,19 @@ async def run_pipeline(story_text_local, generation_mode_local, scene_count_loca
     progress["step"] = "Composing scenes..."
     scenes = await scene_composer.compose_scenes(story_data, assets, scene_timelines)
 
-    video_paths = []
-    for idx, scene_data in enumerate(scenes):
-        progress["step"] = f"Creating final video for scene {scene_data['scene_id']}..."
-        video_path = await scene_composer.create_scene_video(scene_data)
-        video_paths.append(video_path)
+    progress["step"] = f"Creating videos for {len(scenes)} scenes..."
+    video_paths = await scene_composer.create_scene_videos(scenes)
+    for scene_data, video_path in zip(scenes, video_paths):
         logger.info(f"Video for scene {scene_data['scene_id']} created at {video_path}")
 
-    progress["step"] = "Combining video with audio..."
+    # Narrated scenes were encoded with their audio into scenes/video_with_sound
+    variants = scene_composer.video_processor.output_variants
     video_with_sound_paths = []
-    for idx, scene_data in enumerate(scenes):
-        scene_id = scene_data["scene_id"]
-        audio_path = scene_data.get("audio_path")
-        input_video = video_paths[idx]
-
-        if audio_path and Path(audio_path).exists():
-            output_with_sound = asset_manager.get_path("scenes/video_with_sound", f"scene_{scene_id}.mp4")
-            output_with_sound.parent.mkdir(parents=True, exist_ok=True)
-
-            cmd = [
-                'ffmpeg', '-y',
-                '-i', str(input_video),
-                '-i', str(audio_path),
-                '-c:v', 'copy',
-                '-c:a', 'aac',
-                '-shortest',
-                str(output_with_sound)
-            ]
-            logger.info(f"Combining video and audio for scene {scene_id}: {' '.join(cmd)}")
-
-            result = subprocess.run(cmd, capture_output=True, text=True)
-            if result.returncode != 0:
-                logger.error(f"FFmpeg error for scene {scene_id}: {result.stderr}")
-            else:
-                logger.info(f"Combined video with sound at: {output_with_sound}")
-                video_with_sound_paths.append(output_with_sound)
+    for scene_data, video_path in zip(scenes, video_paths):
+        if RenderPlan.audio_path(scene_data):
+            video_with_sound_paths.append(video_path)
         else:
-            logger.warning(f"No audio found for scene {scene_id}, skipping audio merge.")
+            logger.warning(f"No audio found for scene {scene_data['scene_id']}, leaving it out of the final video.")
 
     if video_with_sound_paths:
         progress["step"] = "Stitching all scenes into one final video..."
@@ -261,56 +254,20 @@ async def run_pipeline(story_text_local, generation_mode_local, scene_count_loca
 
         final_video_path = asset_manager.get_path("final_video", "final_video.mp4")
 
-        concat_list_path = final_video_dir / "concat_list.txt"
-        with open(concat_list_path, 'w') as f:
-            for v in video_with_sound_paths:
-                f.write(f"file '{v}'\n")
-
-        cmd = [
-            'ffmpeg', '-y',
-            '-f', 'concat',
-            '-safe', '0',
-            '-i', str(concat_list_path),
-            '-c', 'copy',
-            str(final_video_path)
-        ]
-        logger.info(f"Stitching all scenes: {' '.join(cmd)}")
-        result = subprocess.run(cmd, capture_output=True, text=True)
-        if result.returncode != 0:
-            logger.error(f"Failed to stitch videos: {result.stderr}")
+        # One stream-copy concat per aspect (final_video.mp4, final_video_vertical.mp4, ...), run concurrently
+        variant_parts = zip(*(variants(path) for path in video_with_sound_paths))
+        try:
+            final_paths = await asyncio.gather(*(
+                VideoEncoder.concat(list(parts), variant_path,
+                                    list_path=final_video_dir / f"{variant_path.stem}_concat_list.txt",
+                                    runner=ffmpeg_runner)
+                for variant_path, parts in zip(variants(final_video_path), variant_parts)
+            ))
+            for variant_path in final_paths:
+                logger.info(f"Final stitched video at: {variant_path}")
+        except RuntimeError as e:
+            logger.error(f"Failed to stitch videos: {e}")
             final_video_path = None
-        else:
-            logger.info(f"Final stitched video at: {final_video_path}")
-
-        # After final_video.mp4 is created, produce vertical and horizontal versions
-        if final_video_path and final_video_path.exists():
-            # final_video_vertical (9:16)
-            # 1024x1024 -> crop to 576x1024 (centered horizontally)
-            # crop=width:height:x:y = crop=576:1024:224:0
-            final_video_vertical = final_video_dir / "final_video_vertical.mp4"
-            cmd_vertical = [
-                'ffmpeg', '-y',
-                '-i', str(final_video_path),
-                '-filter:v', 'crop=576:1024:224:0',
-                '-c:a', 'copy',
-                str(final_video_vertical)
-            ]
-            logger.info(f"Creating vertical video: {' '.join(cmd_vertical)}")
-            subprocess.run(cmd_vertical, capture_output=True, text=True)
-
-            # final_video_horizontal (16:9)
-            # 1024x1024 -> crop to 1024x576 (centered vertically)
-            # crop=1024:576:0:224
-            final_video_horizontal = final_video_dir / "final_video_horizontal.mp4"
-            cmd_horizontal = [
-                'ffmpeg', '-y',
-                '-i', str(final_video_path),
-                '-filter:v', 'crop=1024:576:0:224',
-                '-c:a', 'copy',
-                str(final_video_horizontal)
-            ]
-            logger.info(f"Creating horizontal video: {' '.join(cmd_horizontal)}")
-            subprocess.run(cmd_horizontal, capture_output=True, text=True)
     else:
         final_video_path = None
         logger.warning("No video_with_sound files found to stitch into final video.")
@@ -65,6 +65,16 @@ class AssetManager:
         final_video_dir.mkdir(parents=True, exist_ok=True)
         self.dirs["final_video"] = final_video_dir
 
+        # Reopening an existing run (e.g. from a render worker) keeps its metadata
+        metadata_file = self.dirs["metadata"] / "metadata.json"
+        if metadata_file.exists():
+            try:
+                with open(metadata_file, 'r') as f:
+                    self.metadata = json.load(f)
+                return
+            except json.JSONDecodeError:
+                logger.warning(f"Could not parse existing {metadata_file}, starting fresh.")
+
         self.metadata = {
             "run_id": self.run_id,
             "created_at": datetime.now().isoformat(),
@@ -86,8 +96,7 @@ class AssetManager:
     def save_character(self, character_name: str, svg_data: str) -> Path:
         safe_name = self._safe_filename(character_name)
         file_path = self.get_path("characters", f"{safe_name}.svg")
-        with open(file_path, 'w') as f:
-            f.write(svg_data)
+        self._write_atomic(file_path, svg_data)
         self.metadata["assets"]["characters"].append(f"{safe_name}.svg")
         self._save_metadata()
         return file_path
@@ -95,16 +104,22 @@ class AssetManager:
     def save_animation(self, character_name: str, animation_name: str, svg_data: str) -> Path:
         safe_name = self._safe_filename(f"{character_name}_{animation_name}")
         file_path = self.get_path("animations", f"{safe_name}.svg")
-        with open(file_path, 'w') as f:
-            f.write(svg_data)
+        self._write_atomic(file_path, svg_data)
         self.metadata["assets"]["animations"].append(f"{safe_name}.svg")
         self._save_metadata()
         return file_path
 
     def _save_metadata(self):
         metadata_file = self.dirs["metadata"] / "metadata.json"
-        with open(metadata_file, 'w') as f:
-            json.dump(self.metadata, f, indent=2)
+        self._write_atomic(metadata_file, json.dumps(self.metadata, indent=2))
+
+    def _write_atomic(self, file_path: Path, data: str):
+        # Render worker processes may write the same file concurrently; write to a
+        # private temp file and rename so readers never see a partial file
+        temp_path = file_path.with_name(f".{file_path.name}.{os.getpid()}.tmp")
+        with open(temp_path, 'w') as f:
+            f.write(data)
+        os.replace(temp_path, file_path)
 
     def _safe_filename(self, name: str) -> str:
         name = str(name)
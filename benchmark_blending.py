@@ -0,0 +1,71 @@
+"""
+Micro-benchmark of the compositor's blending kernel against the float path.
+
+    python benchmark_blending.py [--repeat N]
+"""
+import argparse
+import time
+
+import numpy as np
+
+from blending import blend_over, blend_over_float
+
+
+def make_sprite(size: int, coverage: float, seed: int = 0) -> np.ndarray:
+    """Premultiplied RGBA sprite: an opaque ellipse with soft edges inside a transparent margin"""
+    rng = np.random.default_rng(seed)
+    yy, xx = np.mgrid[0:size, 0:size]
+    radius = size / 2 * coverage
+    distance = np.hypot(xx - size / 2, yy - size / 2)
+    alpha = np.clip((radius - distance) * 4, 0, 255).astype(np.uint8)
+    rgb = rng.integers(0, 256, (size, size, 3), dtype=np.uint16)
+    premultiplied = (rgb * alpha[..., None] + 127) // 255
+    return np.dstack([premultiplied.astype(np.uint8), alpha])
+
+
+def scene_layer(size: int) -> np.ndarray:
+    """Fully opaque layer, like a scene whose background image has faded in"""
+    layer = make_sprite(size, 1.0)
+    layer[..., 3] = 255
+    return layer
+
+
+def bench(blend, dst: np.ndarray, src: np.ndarray, repeat: int) -> float:
+    """Mean milliseconds per call"""
+    work = dst.copy()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        np.copyto(work, dst)
+        blend(work, src)
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(1)
+    cases = [
+        ("sprite 512px, 70% ellipse", make_sprite(512, 0.7)),
+        ("sprite 256px, 70% ellipse", make_sprite(256, 0.7)),
+        ("scene layer 1024px, opaque", scene_layer(1024)),
+        ("transparent 1024px", np.zeros((1024, 1024, 4), dtype=np.uint8)),
+    ]
+
+    print(f"{'case':<30} {'float ms':>9} {'kernel ms':>10} {'speedup':>8} {'max diff':>9}")
+    for name, src in cases:
+        h, w = src.shape[:2]
+        dst = rng.integers(0, 256, (h, w, 3), dtype=np.uint8)
+        float_ms = bench(blend_over_float, dst, src, args.repeat)
+        kernel_ms = bench(blend_over, dst, src, args.repeat)
+
+        expected, actual = dst.copy(), dst.copy()
+        blend_over_float(expected, src)
+        blend_over(actual, src)
+        diff = np.abs(expected.astype(int) - actual.astype(int)).max()
+        print(f"{name:<30} {float_ms:9.2f} {kernel_ms:10.2f} {float_ms / kernel_ms:7.1f}x {diff:9d}")
+
+
+if __name__ == "__main__":
+    main()
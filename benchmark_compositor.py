@@ -0,0 +1,66 @@
+"""
+Frames-per-second of the frame compositor with and without thread tiling.
+
+Each frame draws a few large moving character sprites over a 1024x1024
+background, the way VideoProcessor.render_segment does. One sprite is
+resampled by SpriteCache, like the scaled sprites of a real render, so
+the check that every thread count gives the same frame covers them too.
+
+    python benchmark_compositor.py [--frames N] [--sprites N] [--threads 1 2 4]
+"""
+import argparse
+import os
+import time
+
+import numpy as np
+
+from benchmark_blending import make_sprite
+from compositor import FrameCompositor
+from sprite_cache import SpriteCache
+
+
+def run(threads: int, base: np.ndarray, sprites, frames: int) -> np.ndarray:
+    """Composite the frames and return the last one; prints frames per second"""
+    height, width = base.shape[:2]
+    with FrameCompositor(threads) as compositor:
+        start = time.perf_counter()
+        for i in range(frames):
+            compositor.begin(base)
+            for s, sprite in enumerate(sprites):
+                x = (i * 7 + s * 300) % width
+                y = height / 2 + (s - len(sprites) / 2) * 120
+                compositor.draw_centered(sprite, x, y)
+            frame = compositor.finish()
+        elapsed = time.perf_counter() - start
+    print(f"{threads:>7} {frames / elapsed:10.1f}")
+    return frame.copy()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--frames", type=int, default=60)
+    parser.add_argument("--sprites", type=int, default=3)
+    parser.add_argument("--size", type=int, default=640, help="sprite size in pixels")
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 2, 4, os.cpu_count() or 1])
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(1)
+    base = rng.integers(0, 256, (1024, 1024, 3), dtype=np.uint8)
+    sprites = [make_sprite(args.size, 0.9, seed) for seed in range(args.sprites)]
+    # Scaled (LANCZOS) sprites have resampling edges that the synthetic ones lack
+    scaled_size = SpriteCache.scaled_size(args.size, args.size, 0.73)
+    sprites.append(SpriteCache().get("resampled", make_sprite(args.size, 0.9, args.sprites), scaled_size))
+
+    print(f"{os.cpu_count()} CPUs, {args.sprites} sprites of {args.size}px plus one scaled, {args.frames} frames")
+    print(f"{'threads':>7} {'frames/s':>10}")
+    reference = None
+    for threads in sorted(set(args.threads)):
+        frame = run(threads, base, sprites, args.frames)
+        if reference is None:
+            reference = frame
+        elif not np.array_equal(frame, reference):
+            print(f"  warning: {threads} threads produced a different frame")
+
+
+if __name__ == "__main__":
+    main()
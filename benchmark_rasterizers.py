@@ -0,0 +1,87 @@
+"""
+Compare SVG rasterizer backends on the animation SVGs of previous runs.
+
+Every backend renders the same frames of each SVG; the report gives the
+frames per second of each backend and its pixel difference from the
+first (reference) backend.
+
+    python benchmark_rasterizers.py [--backends cairosvg resvg] [--frames N] [--size PX]
+"""
+import argparse
+import asyncio
+import glob
+import logging
+import time
+
+import numpy as np
+
+from rasterizers import available_rasterizers
+from svg_processor import SVGProcessor
+
+FPS = 30
+
+
+def render(path: str, backend: str, frames: int, size: int, layered: bool):
+    """Render the first frames of an SVG; returns (frames, seconds)"""
+    processor = SVGProcessor(path, layered=layered, rasterizer=backend)
+    start = time.perf_counter()
+    rendered = asyncio.run(processor.generate_frames(frames / FPS, FPS, frame_format="array", size=size))
+    return list(rendered), time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backends", nargs="+", default=available_rasterizers(),
+                        help="backends to compare; the first is the reference")
+    parser.add_argument("--corpus", default="output/*/animations/*.svg")
+    parser.add_argument("--frames", type=int, default=10, help="frames rendered per SVG")
+    parser.add_argument("--size", type=int, default=512)
+    parser.add_argument("--layered", action="store_true", help="allow layered rendering where supported")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+
+    paths = sorted(glob.glob(args.corpus))
+    if not paths:
+        parser.error(f"No SVGs match {args.corpus}")
+    print(f"{len(paths)} SVGs, {args.frames} frames each at {args.size}px, backends: {', '.join(args.backends)}")
+
+    reference_backend = args.backends[0]
+    totals = {backend: {"frames": 0, "seconds": 0.0, "failed": 0, "diffs": [], "max_diff": 0}
+              for backend in args.backends}
+    for path in paths:
+        reference = None
+        for backend in args.backends:
+            total = totals[backend]
+            try:
+                frames, seconds = render(path, backend, args.frames, args.size, args.layered)
+                diff = None
+                if backend != reference_backend and reference is not None:
+                    # Raises if the backend returned a different frame count or size
+                    diff = np.abs(np.stack(frames).astype(np.int16) - np.stack(reference).astype(np.int16))
+            except Exception as e:
+                total["failed"] += 1
+                print(f"  {backend} failed on {path}: {e}")
+                continue
+            total["frames"] += len(frames)
+            total["seconds"] += seconds
+            if backend == reference_backend:
+                reference = frames
+            elif diff is not None:
+                total["diffs"].append(diff.mean())
+                total["max_diff"] = max(total["max_diff"], int(diff.max()))
+
+    print(f"{'backend':<14} {'frames/s':>9} {'mean diff':>10} {'max diff':>9} {'failed':>7}")
+    for backend in args.backends:
+        total = totals[backend]
+        fps = total["frames"] / total["seconds"] if total["seconds"] else 0.0
+        if backend == reference_backend:
+            mean_diff, max_diff = "(ref)", "(ref)"
+        elif total["diffs"]:
+            mean_diff, max_diff = f"{np.mean(total['diffs']):.3f}", str(total["max_diff"])
+        else:
+            mean_diff, max_diff = "-", "-"
+        print(f"{backend:<14} {fps:9.1f} {mean_diff:>10} {max_diff:>9} {total['failed']:>7}")
+
+
+if __name__ == "__main__":
+    main()
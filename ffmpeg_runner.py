@@ -0,0 +1,82 @@
+import asyncio
+import logging
+import os
+from collections import deque
+from typing import List, Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+class FFmpegError(RuntimeError):
+    """An ffmpeg run that failed or timed out; stderr holds the tail of its output"""
+
+    def __init__(self, message: str, returncode: Optional[int] = None, stderr: str = ""):
+        super().__init__(message)
+        self.returncode = returncode
+        self.stderr = stderr
+
+
+class FFmpegRunner:
+    """
+    Runs ffmpeg commands as asyncio subprocesses without blocking the event loop.
+
+    At most max_concurrent commands run at once; the rest wait on a
+    semaphore, so independent steps (e.g. one concat per output aspect) can
+    simply be gathered. Commands running longer than timeout seconds are
+    killed. Only the last stderr_lines lines of ffmpeg's stderr are kept, for
+    error reports.
+
+    The semaphore belongs to the event loop that first uses it, so create a
+    runner per pipeline run.
+    """
+
+    DEFAULT_TIMEOUT = 30 * 60
+
+    def __init__(self, max_concurrent: Optional[int] = None, timeout: Optional[float] = DEFAULT_TIMEOUT,
+                 stderr_lines: int = 200):
+        self.max_concurrent = max_concurrent or os.cpu_count() or 1
+        self.timeout = timeout
+        self.stderr_lines = stderr_lines
+        self._semaphore = asyncio.Semaphore(self.max_concurrent)
+
+    async def run(self, cmd: Sequence[str], timeout: Optional[float] = None) -> List[str]:
+        """
+        Run one ffmpeg command to completion; returns the kept stderr lines.
+
+        Raises FFmpegError if ffmpeg exits with an error or runs past the
+        timeout (default: the runner's timeout).
+        """
+        timeout = self.timeout if timeout is None else timeout
+        async with self._semaphore:
+            logger.info(f"Running: {' '.join(cmd)}")
+            process = await asyncio.create_subprocess_exec(
+                *cmd,
+                stdin=asyncio.subprocess.DEVNULL,
+                stdout=asyncio.subprocess.DEVNULL,
+                stderr=asyncio.subprocess.PIPE
+            )
+            stderr_tail = deque(maxlen=self.stderr_lines)
+            reader = asyncio.create_task(self._read_stderr(process, stderr_tail))
+            try:
+                await asyncio.wait_for(process.wait(), timeout)
+            except asyncio.TimeoutError:
+                process.kill()
+                await process.wait()
+                raise FFmpegError(f"FFmpeg timed out after {timeout}s", process.returncode,
+                                  "".join(stderr_tail))
+            except asyncio.CancelledError:
+                process.kill()
+                await process.wait()
+                raise
+            finally:
+                await reader
+
+        if process.returncode != 0:
+            stderr = "".join(stderr_tail)
+            logger.error(f"FFmpeg failed with return code {process.returncode}: {stderr}")
+            raise FFmpegError(f"FFmpeg failed with return code {process.returncode}", process.returncode, stderr)
+        return list(stderr_tail)
+
+    @staticmethod
+    async def _read_stderr(process, stderr_tail: deque):
+        async for line in process.stderr:
+            stderr_tail.append(line.decode('utf-8', errors='replace'))
@@ -0,0 +1,65 @@
+import logging
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+logger = logging.getLogger(__name__)
+
+class LRUCache:
+    """
+    Small least-recently-used cache with hit/miss counters.
+
+    Entries are evicted once there are more than max_items of them or their
+    combined size (as passed to put) exceeds max_bytes.
+    """
+
+    def __init__(self, max_items: Optional[int] = None, max_bytes: Optional[int] = None):
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.total_bytes = 0
+        self._items = OrderedDict()
+        self._sizes = {}
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._items
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Return the cached value and mark it as recently used"""
+        try:
+            value = self._items[key]
+        except KeyError:
+            self.misses += 1
+            return default
+        self._items.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key: Hashable, value: Any, size: int = 0):
+        """Store a value, evicting the least recently used entries when full"""
+        self.total_bytes += size - self._sizes.get(key, 0)
+        self._items[key] = value
+        self._sizes[key] = size
+        self._items.move_to_end(key)
+        # Always keep the newest entry, even if it alone exceeds the limits
+        while len(self._items) > 1 and self._over_limit():
+            old_key, _ = self._items.popitem(last=False)
+            self.total_bytes -= self._sizes.pop(old_key)
+
+    def _over_limit(self) -> bool:
+        if self.max_items is not None and len(self._items) > self.max_items:
+            return True
+        return self.max_bytes is not None and self.total_bytes > self.max_bytes
+
+    def clear(self):
+        self._items.clear()
+        self._sizes.clear()
+        self.total_bytes = 0
+
+    def stats(self) -> str:
+        total = self.hits + self.misses
+        hit_rate = (self.hits / total * 100) if total else 0.0
+        return f"{len(self._items)} items ({self.total_bytes / 1e6:.1f} MB), {self.hits} hits, {self.misses} misses ({hit_rate:.1f}% hit rate)"
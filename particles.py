@@ -0,0 +1,159 @@
+import logging
+import math
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+class ParticleSystem:
+    """
+    Ambient particle effect (floating glowing dust) simulated with NumPy.
+
+    Particles are held as arrays of start position, velocity, pulse phase
+    and pulse scale drawn from a seeded RNG, so a scene always gets the same
+    particles. state(t) evaluates every particle at time t in closed form:
+    particles drift at constant velocity (wrapping around the canvas, with
+    discs crossing an edge drawn on both sides), and
+    their opacity and scale pulse like the SVG animations this replaces.
+    Evaluating by time rather than stepping keeps frame ranges rendered by
+    different workers consistent.
+
+    splat() draws all particles into an RGB frame in one vectorized pass,
+    using a precomputed bank of anti-aliased disc sprites per quantized
+    scale and sub-pixel offset.
+    """
+
+    DEFAULT_COUNT = 5
+    # Particle radius and drift per period in pixels of a full-size (1024px) frame
+    DEFAULT_RADIUS = 5.0
+    DEFAULT_DRIFT = 50.0
+    # Quantization of particle scale and sub-pixel position for the sprite bank
+    SCALE_STEPS = 8
+    SUBPIXEL_STEPS = 4
+
+    def __init__(self, count: int = DEFAULT_COUNT, width: int = 1024, height: int = 1024, seed: int = 0,
+                 color: Tuple[int, int, int] = (255, 215, 0), radius: float = DEFAULT_RADIUS, period: float = 5.0,
+                 drift: float = DEFAULT_DRIFT, opacity: Tuple[float, float] = (0.2, 0.8),
+                 max_scale: Tuple[float, float] = (1.2, 1.5)):
+        """
+        Each particle drifts up to `drift` pixels per axis every `period`
+        seconds, pulses its opacity between the `opacity` bounds over one
+        period and its scale from 1 up to a value within `max_scale` over
+        1.2 periods.
+        """
+        self.count = count
+        self.width = width
+        self.height = height
+        self.color = np.array(color, dtype=np.float32)
+        self.radius = radius
+        self.period = period
+        self.opacity_range = opacity
+        self.max_scale = max_scale[1]
+
+        rng = np.random.default_rng(seed)
+        self.position = rng.uniform((0, 0), (width, height), size=(count, 2))
+        self.velocity = rng.uniform(-drift, drift, size=(count, 2)) / period
+        self.phase = rng.uniform(0, 1, size=count)
+        self.pulse_scale = rng.uniform(max_scale[0], max_scale[1], size=count)
+
+        self._bank, self._sprite_size = self._sprite_bank()
+        offsets = np.arange(self._sprite_size)
+        self._dy, self._dx = (g.ravel() for g in np.meshgrid(offsets, offsets, indexing="ij"))
+
+    @classmethod
+    def from_spec(cls, spec: Dict, width: int, height: int, scale: float = 1.0) -> "ParticleSystem":
+        """
+        Create the particle system described by a scene's "particles" entry;
+        scale sizes the particles for frames rendered below full size.
+        """
+        return cls(count=int(spec.get("count", cls.DEFAULT_COUNT)), width=width, height=height,
+                   seed=int(spec.get("seed", 0)), radius=cls.DEFAULT_RADIUS * scale,
+                   drift=cls.DEFAULT_DRIFT * scale)
+
+    def _sprite_bank(self) -> Tuple[np.ndarray, int]:
+        """Disc coverage sprites indexed by (scale step, sub-pixel y, sub-pixel x)"""
+        size = int(math.ceil(2 * (self.radius * self.max_scale + 1))) + 1
+        steps, sub = self.SCALE_STEPS, self.SUBPIXEL_STEPS
+        scales = 1 + (self.max_scale - 1) * np.arange(steps) / max(1, steps - 1)
+        fractions = np.arange(sub) / sub
+        yy, xx = np.mgrid[0:size, 0:size] + 0.5 - size / 2
+        # (sub y, sub x, size, size) distances of pixel centres from the disc centre
+        dy = yy[None] - fractions[:, None, None]
+        dx = xx[None] - fractions[:, None, None]
+        distance = np.sqrt(dy[:, None] ** 2 + dx[None, :] ** 2)
+        radii = self.radius * scales[:, None, None, None, None]
+        coverage = np.clip(radii - distance + 0.5, 0, 1)
+        return coverage.reshape(steps * sub * sub, size * size).astype(np.float32), size
+
+    def state(self, t: float) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Particle centre positions (n, 2), opacities (n,) and scales (n,) at time t"""
+        position = self.position + self.velocity * t
+        position %= (self.width, self.height)
+        low, high = self.opacity_range
+        pulse = 0.5 + 0.5 * np.cos(2 * np.pi * (t / self.period + self.phase))
+        opacity = low + (high - low) * pulse
+        # Scale pulses 1 -> pulse_scale -> 1 over 1.2 periods
+        scale_pulse = 0.5 - 0.5 * np.cos(2 * np.pi * (t / (1.2 * self.period) + self.phase))
+        scale = 1 + (self.pulse_scale - 1) * scale_pulse
+        return position, opacity, scale
+
+    def splat(self, frame: np.ndarray, t: float) -> List[Tuple[int, int, int, int]]:
+        """
+        Blend the particles at time t over a contiguous (h, w, 3) uint8
+        frame in place.
+
+        Returns the (x1, y1, x2, y2) rectangles drawn into: one per particle,
+        or up to four for a disc wrapping across the frame edges.
+        """
+        if self.count == 0:
+            return []
+        height, width = frame.shape[:2]
+        position, opacity, scale = self.state(t)
+
+        steps, sub, size = self.SCALE_STEPS, self.SUBPIXEL_STEPS, self._sprite_size
+        step = np.rint((scale - 1) / max(1e-6, self.max_scale - 1) * (steps - 1)).astype(np.intp)
+        origin = position - size / 2
+        whole = np.floor(origin).astype(np.intp)
+        fraction = np.minimum((origin - whole) * sub, sub - 1).astype(np.intp)
+        sprite = (np.clip(step, 0, steps - 1) * sub + fraction[:, 1]) * sub + fraction[:, 0]
+
+        # Per-particle pixel coordinates and coverage, flattened to (n * size * size,).
+        # Coordinates wrap like positions in state(), so a disc crossing an
+        # edge shows on both sides instead of popping when its centre wraps
+        rows = (whole[:, 1][:, None] + self._dy).ravel() % height
+        cols = (whole[:, 0][:, None] + self._dx).ravel() % width
+        alpha = self._bank[sprite] * opacity[:, None].astype(np.float32)
+        visible = alpha.any(axis=1)
+        alpha = alpha.ravel()
+        inside = alpha > 0
+        if not inside.any():
+            return []
+
+        # Particles share one colour, so overlapping "over" composites reduce
+        # to the product of transmittances: sum log(1 - alpha) per pixel,
+        # accumulated over the touched pixels only
+        covered, pixel_index = np.unique(rows[inside] * width + cols[inside], return_inverse=True)
+        log_transmittance = np.bincount(pixel_index.reshape(-1), weights=np.log1p(-alpha[inside]),
+                                        minlength=len(covered))
+        transmittance = np.exp(log_transmittance).astype(np.float32)[:, None]
+
+        flat = frame.reshape(-1, frame.shape[2])
+        blended = flat[covered, :3] * transmittance + self.color * (1 - transmittance)
+        flat[covered, :3] = (blended + 0.5).astype(np.uint8)
+
+        rects = []
+        for x, y in whole[visible].tolist():
+            for x1, x2 in self._wrapped_spans(x, size, width):
+                for y1, y2 in self._wrapped_spans(y, size, height):
+                    rects.append((x1, y1, x2, y2))
+        return rects
+
+    @staticmethod
+    def _wrapped_spans(start: int, length: int, limit: int) -> List[Tuple[int, int]]:
+        """The span [start, start + length) wrapped onto [0, limit), as one or two spans"""
+        start %= limit
+        end = start + min(length, limit)
+        if end <= limit:
+            return [(start, end)]
+        return [(start, limit), (0, end - limit)]
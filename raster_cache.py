@@ -0,0 +1,126 @@
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path
+from typing import Optional, Sequence, Tuple
+
+import numpy as np
+
+from svg_processor import LoopedFrames
+
+logger = logging.getLogger(__name__)
+
+class RasterCache:
+    """
+    Persistent, content-addressed cache of rendered sprite tracks.
+
+    Each track is stored as one contiguous (n, h, w, 4) atlas of its distinct
+    premultiplied RGBA frames in a .npy file, plus a small JSON index mapping
+    every frame of the track to its atlas slot. Cached tracks are loaded with
+    np.load(mmap_mode='r'), so a warm hit costs a file open and the pages the
+    compositor actually touches. Keys hash the SVG bytes, the frame times
+    (duration, fps and animation sample rate), the raster size and the
+    rasterizer version.
+
+    Files are written atomically, so concurrent render workers never see a
+    partial entry. When the atlases exceed max_bytes, the least recently
+    used ones (by modification time, refreshed on every hit) are deleted.
+    """
+
+    # Default disk space for cached atlases
+    DEFAULT_MAX_BYTES = 2 * 1024 * 1024 * 1024
+
+    def __init__(self, cache_dir, max_bytes: Optional[int] = DEFAULT_MAX_BYTES):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(svg_data: str, duration: float, fps: int, size: Tuple[int, int], version: str,
+            sample_fps: Optional[float] = None) -> str:
+        digest = hashlib.sha256()
+        digest.update(svg_data.encode('utf-8'))
+        digest.update(f"\0{duration!r}\0{fps}\0{sample_fps!r}\0{size[0]}x{size[1]}\0{version}".encode('utf-8'))
+        return digest.hexdigest()
+
+    def _paths(self, key: str) -> Tuple[Path, Path]:
+        return self.cache_dir / f"{key}.npy", self.cache_dir / f"{key}.json"
+
+    def contains(self, key: str) -> bool:
+        return self._paths(key)[1].exists()
+
+    def load(self, key: str) -> Optional[LoopedFrames]:
+        """The cached frames of a track, memory-mapped from disk, or None"""
+        atlas_path, index_path = self._paths(key)
+        try:
+            with open(index_path) as f:
+                index = json.load(f)
+            atlas = np.load(atlas_path, mmap_mode='r')
+            os.utime(atlas_path)
+        except (OSError, ValueError) as e:
+            if not isinstance(e, FileNotFoundError):
+                logger.warning(f"Ignoring unreadable raster cache entry {key}: {e}")
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        slots = np.asarray(index["slots"], dtype=np.int64)
+        # Each frame is a slot of the atlas; LoopedFrames maps frames to slots
+        return LoopedFrames(atlas.view(np.ndarray), len(slots), 1, len(slots), slots)
+
+    def store(self, key: str, frames: Sequence[np.ndarray]):
+        """Write the frames of a track as an atlas of its distinct frames"""
+        slots = []
+        distinct = []
+        slot_of = {}
+        for frame in frames:
+            if id(frame) not in slot_of:
+                slot_of[id(frame)] = len(distinct)
+                distinct.append(frame)
+            slots.append(slot_of[id(frame)])
+        if not distinct:
+            return
+
+        atlas_path, index_path = self._paths(key)
+        temp_path = atlas_path.with_name(f".{atlas_path.name}.{os.getpid()}.tmp")
+        with open(temp_path, 'wb') as f:
+            np.save(f, np.stack(distinct))
+        os.replace(temp_path, atlas_path)
+        # The index goes last: an entry counts as present once its index exists
+        temp_path = index_path.with_name(f".{index_path.name}.{os.getpid()}.tmp")
+        with open(temp_path, 'w') as f:
+            json.dump({"slots": slots}, f)
+        os.replace(temp_path, index_path)
+        self._evict()
+
+    def _evict(self):
+        """Delete least recently used atlases until the cache fits in max_bytes"""
+        if self.max_bytes is None:
+            return
+        entries = []
+        for atlas_path in self.cache_dir.glob("*.npy"):
+            try:
+                stat = atlas_path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, atlas_path))
+        total = sum(size for _, size, _ in entries)
+        # Always keep the newest entry, even if it alone exceeds the limit
+        for _, size, atlas_path in sorted(entries)[:-1]:
+            if total <= self.max_bytes:
+                break
+            for path in (atlas_path.with_suffix(".json"), atlas_path):
+                try:
+                    path.unlink()
+                except FileNotFoundError:
+                    pass
+            total -= size
+            logger.info(f"Evicted raster cache entry {atlas_path.stem}")
+
+    def stats(self) -> str:
+        total = self.hits + self.misses
+        hit_rate = (self.hits / total * 100) if total else 0.0
+        return f"{self.hits} hits, {self.misses} misses ({hit_rate:.1f}% hit rate)"
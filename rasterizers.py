@@ -0,0 +1,235 @@
+import io
+import logging
+import shutil
+import subprocess
+import sys
+from abc import ABC, abstractmethod
+from typing import Dict, List, Optional, Tuple, Type
+
+import numpy as np
+from lxml import etree
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+try:
+    import cairosvg
+    from cairosvg.parser import Tree
+    from cairosvg.surface import PNGSurface
+except (ImportError, OSError) as e:
+    # OSError: cairosvg is installed but the cairo library is missing
+    logger.warning(f"cairosvg rasterizer unavailable: {e}")
+    cairosvg = None
+
+try:
+    import resvg_py
+except ImportError:
+    resvg_py = None
+
+# Byte order of cairo's native-endian ARGB32 pixels, mapped to RGBA
+_CAIRO_TO_RGBA = [2, 1, 0, 3] if sys.byteorder == 'little' else [1, 2, 3, 0]
+
+
+def surface_to_array(cairo_surface):
+    """Copy a cairo ARGB32 image surface into an (h, w, 4) premultiplied RGBA array"""
+    cairo_surface.flush()
+    width = cairo_surface.get_width()
+    height = cairo_surface.get_height()
+    stride = cairo_surface.get_stride()
+    data = np.frombuffer(cairo_surface.get_data(), dtype=np.uint8).reshape(height, stride)
+    pixels = data[:, :width * 4].reshape(height, width, 4)
+    # Reorder the channels and copy out of the surface buffer in one step
+    return np.take(pixels, _CAIRO_TO_RGBA, axis=2)
+
+
+def png_to_array(png: bytes, size: Tuple[int, int]) -> np.ndarray:
+    """Decode PNG bytes into an (h, w, 4) premultiplied RGBA array of the expected size"""
+    with Image.open(io.BytesIO(png)) as img:
+        if img.size != tuple(size):
+            raise ValueError(f"Rasterizer returned {img.size[0]}x{img.size[1]}, expected {size[0]}x{size[1]}")
+        return np.asarray(img.convert('RGBA').convert('RGBa'))
+
+
+def resolve_viewport(svg_bytes: bytes, parent_size: int) -> bytes:
+    """
+    Give the root <svg> absolute width and height, resolving missing and
+    percentage values against parent_size the way cairosvg does with its
+    parent_width and parent_height, for backends that take no parent size
+    """
+    root = etree.fromstring(svg_bytes)
+    changed = False
+    for attr in ("width", "height"):
+        value = root.get(attr, "100%").strip()
+        if value.endswith("%"):
+            root.set(attr, f"{float(value[:-1]) * parent_size / 100:g}")
+            changed = True
+    return etree.tostring(root) if changed else svg_bytes
+
+
+class Rasterizer(ABC):
+    """
+    SVG rasterizer backend.
+
+    Backends turn serialized SVG documents into premultiplied RGBA uint8
+    arrays of a given (width, height); parent_size is the viewport size that
+    percentage lengths resolve against. Backends register themselves by
+    name with register_rasterizer and are created with get_rasterizer.
+    """
+
+    name = ""
+    # Whether render_layer is supported (needed by svg_layers.LayeredRenderer)
+    supports_layers = False
+
+    @classmethod
+    def available(cls) -> bool:
+        """Whether the backend's library or program is installed"""
+        return True
+
+    @property
+    def version(self) -> str:
+        """Identifies the backend release, for keying persistent raster caches"""
+        return self.name
+
+    @abstractmethod
+    def render(self, svg_bytes: bytes, size: Tuple[int, int], parent_size: int) -> np.ndarray:
+        pass
+
+    def render_png(self, svg_bytes: bytes, size: Tuple[int, int], parent_size: int) -> bytes:
+        rgba = self.render(svg_bytes, size, parent_size)
+        img = Image.frombuffer('RGBa', size, rgba, 'raw', 'RGBa', 0, 1).convert('RGBA')
+        output = io.BytesIO()
+        img.save(output, format='PNG')
+        return output.getvalue()
+
+    def render_layer(self, svg_bytes: bytes, size: Tuple[int, int],
+                     parent_size: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Rasterize a layer; returns the RGBA array and the root user space to pixel matrix"""
+        raise NotImplementedError(f"The {self.name} rasterizer does not report its viewport transform")
+
+
+_RASTERIZERS: Dict[str, Type[Rasterizer]] = {}
+DEFAULT_RASTERIZER = "cairosvg"
+
+
+def register_rasterizer(cls: Type[Rasterizer]) -> Type[Rasterizer]:
+    """Class decorator adding a Rasterizer backend to the registry under its name"""
+    _RASTERIZERS[cls.name] = cls
+    return cls
+
+
+def available_rasterizers() -> List[str]:
+    return [name for name, cls in _RASTERIZERS.items() if cls.available()]
+
+
+def get_rasterizer(name: Optional[str] = None) -> Rasterizer:
+    """Create the named rasterizer backend (default DEFAULT_RASTERIZER)"""
+    name = name or DEFAULT_RASTERIZER
+    cls = _RASTERIZERS.get(name)
+    if cls is None:
+        raise ValueError(f"Unknown rasterizer: {name}. Registered: {', '.join(_RASTERIZERS)}")
+    if not cls.available():
+        raise ValueError(f"Rasterizer {name} is not installed")
+    return cls()
+
+
+@register_rasterizer
+class CairoSVGRasterizer(Rasterizer):
+    """cairosvg, drawing straight onto an in-memory cairo image surface (no PNG encoding)"""
+
+    name = "cairosvg"
+    supports_layers = True
+
+    @classmethod
+    def available(cls) -> bool:
+        return cairosvg is not None
+
+    @property
+    def version(self) -> str:
+        return f"cairosvg-{cairosvg.__version__}"
+
+    def _surface(self, svg_bytes: bytes, size: Tuple[int, int], parent_size: int):
+        width, height = size
+        return PNGSurface(
+            Tree(bytestring=svg_bytes),
+            None,
+            96,
+            parent_width=parent_size,
+            parent_height=parent_size,
+            output_width=width,
+            output_height=height,
+            background_color="rgba(0,0,0,0)"
+        )
+
+    def render(self, svg_bytes: bytes, size: Tuple[int, int], parent_size: int) -> np.ndarray:
+        return surface_to_array(self._surface(svg_bytes, size, parent_size).cairo)
+
+    def render_png(self, svg_bytes: bytes, size: Tuple[int, int], parent_size: int) -> bytes:
+        width, height = size
+        return cairosvg.svg2png(
+            bytestring=svg_bytes,
+            output_width=width,
+            output_height=height,
+            background_color="rgba(0,0,0,0)",
+            parent_width=parent_size,
+            parent_height=parent_size
+        )
+
+    def render_layer(self, svg_bytes: bytes, size: Tuple[int, int],
+                     parent_size: int) -> Tuple[np.ndarray, np.ndarray]:
+        surface = self._surface(svg_bytes, size, parent_size)
+        xx, yx, xy, yy, x0, y0 = surface.context.get_matrix()
+        viewport = np.array([[xx, xy, x0], [yx, yy, y0], [0.0, 0.0, 1.0]])
+        return surface_to_array(surface.cairo), viewport
+
+
+@register_rasterizer
+class RsvgConvertRasterizer(Rasterizer):
+    """librsvg through the rsvg-convert command line tool"""
+
+    name = "rsvg-convert"
+    # `rsvg-convert --version`, queried once per process
+    _version: Optional[str] = None
+
+    @classmethod
+    def available(cls) -> bool:
+        return shutil.which("rsvg-convert") is not None
+
+    @property
+    def version(self) -> str:
+        cls = type(self)
+        if cls._version is None:
+            result = subprocess.run(["rsvg-convert", "--version"], capture_output=True, text=True)
+            cls._version = result.stdout.strip() or self.name
+        return cls._version
+
+    def render(self, svg_bytes: bytes, size: Tuple[int, int], parent_size: int) -> np.ndarray:
+        width, height = size
+        result = subprocess.run(
+            ["rsvg-convert", "--width", str(width), "--height", str(height), "--format", "png"],
+            input=resolve_viewport(svg_bytes, parent_size),
+            capture_output=True
+        )
+        if result.returncode != 0:
+            raise RuntimeError(f"rsvg-convert failed: {result.stderr.decode(errors='replace').strip()}")
+        return png_to_array(result.stdout, size)
+
+
+@register_rasterizer
+class ResvgRasterizer(Rasterizer):
+    """resvg through the resvg_py package"""
+
+    name = "resvg"
+
+    @classmethod
+    def available(cls) -> bool:
+        return resvg_py is not None
+
+    @property
+    def version(self) -> str:
+        return f"resvg_py-{getattr(resvg_py, '__version__', 'unknown')}"
+
+    def render(self, svg_bytes: bytes, size: Tuple[int, int], parent_size: int) -> np.ndarray:
+        width, height = size
+        svg_string = resolve_viewport(svg_bytes, parent_size).decode('utf-8')
+        png = resvg_py.svg_to_bytes(svg_string=svg_string, width=width, height=height)
+        return png_to_array(bytes(png), size)
@@ -0,0 +1,226 @@
+import json
+import logging
+import math
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+@dataclass
+class SpriteTrack:
+    """One rasterized frame sequence used by the compositor (a base SVG or an animation)"""
+    character_name: str
+    animation_name: Optional[str]
+    duration: float
+    frame_count: int
+    # Animation sample rate; frames between samples are held (None = every frame)
+    sample_fps: Optional[float] = None
+
+    def to_dict(self):
+        return {
+            "character_name": self.character_name,
+            "animation_name": self.animation_name,
+            "duration": self.duration,
+            "frame_count": self.frame_count,
+            "sample_fps": self.sample_fps
+        }
+
+
+class RenderPlan:
+    """
+    Per-frame compositing instructions for one scene, stored as arrays.
+
+    Every array has shape (characters, frames): which sprite track to draw
+    (-1 when the character is not on screen), the frame of that track, the
+    centre position and the scale. The plan is compiled once from the scene's
+    timeline movements, so the compositor only needs array lookups.
+
+    Idle (base SVG) tracks are sampled at IDLE_SAMPLE_FPS by default and
+    animations at the full frame rate. The scene's "idle_fps" and
+    "animation_fps" entries override those defaults (a rate of fps or more
+    samples every frame), and a movement's "animation_fps" overrides the
+    rate of its animation.
+    """
+
+    # Subtle idle loops are sampled "on twos" and held in between
+    IDLE_SAMPLE_FPS = 15
+
+    def __init__(self, scene_id, fps: int, frame_count: int, characters: List[str],
+                 tracks: List[SpriteTrack], track_ids: np.ndarray, frame_indices: np.ndarray,
+                 x: np.ndarray, y: np.ndarray, scale: np.ndarray):
+        self.scene_id = scene_id
+        self.fps = fps
+        self.frame_count = frame_count
+        self.characters = characters
+        self.tracks = tracks
+        self.track_ids = track_ids
+        self.frame_indices = frame_indices
+        self.x = x
+        self.y = y
+        self.scale = scale
+
+    @staticmethod
+    def audio_path(scene_data: Dict) -> Optional[Path]:
+        """The scene's narration audio file, if it has one"""
+        audio_path = scene_data.get("audio_path")
+        if audio_path and scene_data.get("audio_duration") and Path(audio_path).exists():
+            return Path(audio_path)
+        return None
+
+    @classmethod
+    def scene_frame_count(cls, scene_data: Dict, fps: int) -> int:
+        """
+        Frames in the scene video. Narrated scenes last exactly as long as
+        their audio, rounded up to a whole frame, so muxing never has to trim
+        the audio; silent scenes last their timeline duration.
+        """
+        if cls.audio_path(scene_data) is not None:
+            return math.ceil(round(scene_data["audio_duration"] * fps, 6))
+        return int(scene_data.get("duration", 5.0) * fps)
+
+    @classmethod
+    def from_scene_data(cls, scene_data: Dict, fps: int) -> "RenderPlan":
+        """Compile the plan from the scene's characters and their timeline movements"""
+        duration = scene_data.get("duration", 5.0)
+        frame_count = cls.scene_frame_count(scene_data, fps)
+        characters = scene_data.get("characters", [])
+        times = np.arange(frame_count) / fps
+
+        shape = (len(characters), frame_count)
+        track_ids = np.full(shape, -1, dtype=np.int32)
+        frame_indices = np.zeros(shape, dtype=np.int32)
+        x = np.zeros(shape, dtype=np.float64)
+        y = np.zeros(shape, dtype=np.float64)
+        scale = np.ones(shape, dtype=np.float64)
+
+        tracks = []
+        track_lookup = {}
+
+        idle_fps = scene_data.get("idle_fps") or cls.IDLE_SAMPLE_FPS
+        animation_fps = scene_data.get("animation_fps")
+
+        def track_id_for(char_name, anim_name, track_duration, sample_fps):
+            key = (char_name, anim_name)
+            if key not in track_lookup:
+                track_lookup[key] = len(tracks)
+                tracks.append(SpriteTrack(char_name, anim_name, track_duration, int(track_duration * fps),
+                                          sample_fps))
+            return track_lookup[key]
+
+        for c, char_data in enumerate(characters):
+            char_name = char_data["name"]
+            movements = char_data["movements"]
+            animations = char_data.get("animations", {})
+            if not movements:
+                continue
+
+            # Each animation is rendered for the duration of the first movement that uses it;
+            # the base SVG covers the whole scene. Unknown animations fall back to the base.
+            movement_tracks = []
+            for m in movements:
+                anim_name = m["animation_name"]
+                if anim_name is not None and anim_name in animations:
+                    first = next(mm for mm in movements if mm["animation_name"] == anim_name)
+                    movement_tracks.append(track_id_for(char_name, anim_name, first["end_time"] - first["start_time"],
+                                                        first.get("animation_fps") or animation_fps))
+                else:
+                    movement_tracks.append(track_id_for(char_name, None, duration, idle_fps))
+
+            # The first movement whose window contains the frame time wins
+            active = np.full(frame_count, -1, dtype=np.int64)
+            for k in reversed(range(len(movements))):
+                m = movements[k]
+                active[(times >= m["start_time"]) & (times <= m["end_time"])] = k
+
+            frames = np.nonzero(active >= 0)[0]
+            if len(frames) == 0:
+                continue
+            k = active[frames]
+
+            def column(key, index=None):
+                values = [m[key] if index is None else m[key][index] for m in movements]
+                return np.asarray(values, dtype=np.float64)[k]
+
+            start_time = column("start_time")
+            movement_duration = column("end_time") - start_time
+            movement_duration[movement_duration <= 0] = 0.001
+            t = np.clip((times[frames] - start_time) / movement_duration, 0.0, 1.0)
+
+            frame_track = np.asarray(movement_tracks, dtype=np.int32)[k]
+            track_lengths = np.asarray([tracks[i].frame_count for i in movement_tracks], dtype=np.int64)[k]
+            # Tracks with no frames leave the character off screen
+            visible = track_lengths > 0
+            frames, t, frame_track, track_lengths = frames[visible], t[visible], frame_track[visible], track_lengths[visible]
+            k = k[visible]
+
+            track_ids[c, frames] = frame_track
+            frame_indices[c, frames] = (t * (track_lengths - 1)).astype(np.int32)
+            sx, sy = column("start_position", 0), column("start_position", 1)
+            ex, ey = column("end_position", 0), column("end_position", 1)
+            x[c, frames] = sx + (ex - sx) * t
+            y[c, frames] = sy + (ey - sy) * t
+            s_scale, e_scale = column("start_scale"), column("end_scale")
+            scale[c, frames] = s_scale + (e_scale - s_scale) * t
+
+        return cls(
+            scene_id=scene_data.get("scene_id"),
+            fps=fps,
+            frame_count=frame_count,
+            characters=[c["name"] for c in characters],
+            tracks=tracks,
+            track_ids=track_ids,
+            frame_indices=frame_indices,
+            x=x,
+            y=y,
+            scale=scale
+        )
+
+    def max_scales(self) -> np.ndarray:
+        """Largest scale each sprite track is drawn at (0 for tracks never on screen)"""
+        result = np.zeros(len(self.tracks), dtype=np.float64)
+        visible = self.track_ids >= 0
+        np.maximum.at(result, self.track_ids[visible], self.scale[visible])
+        return result
+
+    def to_dict(self):
+        return {
+            "scene_id": self.scene_id,
+            "fps": self.fps,
+            "frame_count": self.frame_count,
+            "characters": self.characters,
+            "tracks": [t.to_dict() for t in self.tracks],
+            "track_ids": self.track_ids.tolist(),
+            "frame_indices": self.frame_indices.tolist(),
+            "x": self.x.tolist(),
+            "y": self.y.tolist(),
+            "scale": self.scale.tolist()
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "RenderPlan":
+        shape = (len(data["characters"]), data["frame_count"])
+        return cls(
+            scene_id=data["scene_id"],
+            fps=data["fps"],
+            frame_count=data["frame_count"],
+            characters=data["characters"],
+            tracks=[SpriteTrack(**t) for t in data["tracks"]],
+            track_ids=np.asarray(data["track_ids"], dtype=np.int32).reshape(shape),
+            frame_indices=np.asarray(data["frame_indices"], dtype=np.int32).reshape(shape),
+            x=np.asarray(data["x"], dtype=np.float64).reshape(shape),
+            y=np.asarray(data["y"], dtype=np.float64).reshape(shape),
+            scale=np.asarray(data["scale"], dtype=np.float64).reshape(shape)
+        )
+
+    def save(self, path: Path):
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f)
+        logger.info(f"Saved render plan for scene {self.scene_id} to {path}")
+
+    @classmethod
+    def load(cls, path: Path) -> "RenderPlan":
+        with open(path, 'r') as f:
+            return cls.from_dict(json.load(f))
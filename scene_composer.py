@@ -1,5 +1,7 @@
+import asyncio
 import logging
-import random
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 from typing import Dict, List, Optional, Tuple
 import json
@@ -7,7 +9,11 @@ import os
 import svgwrite
 from lxml import etree
 from asset_manager import AssetManager
-from video_processor import VideoProcessor
+from ffmpeg_runner import FFmpegRunner
+from particles import ParticleSystem
+from render_plan import RenderPlan
+from video_encoder import DEFAULT_ASPECTS, OutputAspect
+from video_processor import VideoProcessor, render_scene_segment
 
 logging.basicConfig(
     level=logging.DEBUG,
@@ -16,9 +22,29 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 class SceneComposer:
-    def __init__(self, asset_manager: Optional[AssetManager] = None):
+    def __init__(self, asset_manager: Optional[AssetManager] = None, memory_budget_mb: Optional[float] = None,
+                 max_workers: Optional[int] = None, segments_per_scene: Optional[int] = None,
+                 compositor_threads: int = 1, aspects: Optional[Tuple[OutputAspect, ...]] = DEFAULT_ASPECTS,
+                 ffmpeg_runner: Optional[FFmpegRunner] = None, profile: Optional[str] = None):
+        """
+        max_workers caps the number of worker processes used for rendering
+        (defaults to the CPU count; 1 renders in-process). segments_per_scene
+        splits each scene's frame range into chunks rendered in parallel;
+        by default scenes are split just enough to keep every worker busy.
+        compositor_threads tiles each frame's compositing over that many
+        threads inside every renderer. aspects are the cropped variants every
+        scene video is also encoded as (square, vertical and horizontal by
+        default). ffmpeg_runner runs the segment concats (see
+        ffmpeg_runner.FFmpegRunner). profile names the encoding profile
+        (draft, preview or final; see video_encoder.ENCODING_PROFILES).
+        """
         self.asset_manager = asset_manager or AssetManager()
-        self.video_processor = VideoProcessor(self.asset_manager)
+        self.memory_budget_mb = memory_budget_mb
+        self.max_workers = max_workers
+        self.segments_per_scene = segments_per_scene
+        self.video_processor = VideoProcessor(self.asset_manager, memory_budget_mb=memory_budget_mb,
+                                              compositor_threads=compositor_threads, aspects=aspects,
+                                              ffmpeg_runner=ffmpeg_runner, profile=profile)
 
     async def compose_scenes(self, story_data: Dict, assets: Dict, scene_timelines: List) -> List[Dict]:
         composed_scenes = []
@@ -49,7 +75,8 @@ class SceneComposer:
                         "end_position": list(m.end_position),
                         "start_scale": m.start_scale,
                         "end_scale": m.end_scale,
-                        "animation_name": m.animation_name
+                        "animation_name": m.animation_name,
+                        "animation_fps": m.animation_fps
                     })
 
                 # Assign characters with base_path and animations
@@ -100,6 +127,11 @@ class SceneComposer:
                     else:
                         logger.warning(f"No SVG found for character {char_name} in assets. Skipping.")
 
+            # Ambient particle density: the timeline's setting, else the story scene's
+            particle_count = timeline.particle_count if timeline else None
+            if particle_count is None:
+                particle_count = scene.get("particle_count", ParticleSystem.DEFAULT_COUNT)
+
             scene_data = {
                 "scene_id": scene["scene_id"],
                 "svg": svg_string,
@@ -108,7 +140,12 @@ class SceneComposer:
                 "background_path": scene.get("background_path", ""),
                 "audio_path": scene.get("audio_path", ""),
                 "audio_duration": scene.get("audio_duration", scene_duration),
-                "characters": character_dicts
+                "characters": character_dicts,
+                # Animation sample rate overrides from the timeline (see RenderPlan)
+                "idle_fps": timeline.idle_fps if timeline else None,
+                "animation_fps": timeline.animation_fps if timeline else None,
+                # Seeded by scene position so re-renders draw the same particles
+                "particles": {"count": particle_count, "seed": i} if scene.get("ambient_effects") else None
             }
 
             composed_scenes.append(scene_data)
@@ -117,54 +154,75 @@ class SceneComposer:
         return composed_scenes
 
     async def create_scene_video(self, scene_data: Dict) -> Path:
-        output_path = self.asset_manager.get_path("scenes/video", f"scene_{scene_data['scene_id']}.mp4")
+        output_path = self.video_processor.scene_video_path(scene_data)
         video_path = await self.video_processor.create_scene_video(scene_data, output_path=output_path)
         return video_path
 
-    def _create_particle_effect(self, duration: float, delay: float = 0) -> svgwrite.container.Group:
-        try:
-            particles = svgwrite.container.Group(id="particles")
-            for i in range(5):
-                particle = svgwrite.container.Group(id=f"particle_{i}")
-                x = random.randint(0, 1000)
-                y = random.randint(0, 1000)
-                circle = svgwrite.shapes.Circle(center=(x, y), r=5, fill="#FFD700", opacity=0.8)
-                particle.add(circle)
-
-                float_anim = svgwrite.animate.AnimateTransform(
-                    attributeName="transform",
-                    type="translate",
-                    values=f"0,0; {random.randint(-50, 50)},{random.randint(-50, 50)}",
-                    dur=f"{duration}s",
-                    repeatCount="indefinite",
-                    additive="sum",
-                    begin=f"{delay}s"
-                )
-                fade_anim = svgwrite.animate.Animate(
-                    attributeName="opacity",
-                    values="0.8;0.2;0.8",
-                    dur=f"{duration}s",
-                    repeatCount="indefinite",
-                    begin=f"{delay}s"
-                )
-                scale_anim = svgwrite.animate.AnimateTransform(
-                    attributeName="transform",
-                    type="scale",
-                    values=f"1;{random.uniform(1.2, 1.5)};1",
-                    dur=f"{duration*1.2}s",
-                    repeatCount="indefinite",
-                    additive="sum",
-                    begin=f"{delay}s"
-                )
-
-                particle.add(float_anim)
-                particle.add(fade_anim)
-                particle.add(scale_anim)
-                particles.add(particle)
-            return particles
-        except Exception as e:
-            logger.error(f"Failed to create particle effect: {e}")
-            return svgwrite.container.Group(id="particles")
+    async def create_scene_videos(self, scenes: List[Dict]) -> List[Path]:
+        """
+        Render every scene video concurrently in a process pool.
+
+        Scene rendering is CPU bound (rasterization, compositing, encoding),
+        so each scene, or each frame-range segment of a scene, runs in its own
+        worker process. Segments are stitched back together per scene and the
+        results are returned in scene order, ready for concatenation. Scenes
+        with narration come back with their audio already muxed in. Sprite
+        tracks are rasterized once per run into the raster cache before the
+        renders start (see VideoProcessor.warm_sprite_tracks); with the cache
+        disabled each worker rasterizes its own.
+        """
+        if not scenes:
+            return []
+
+        max_workers = self.max_workers or os.cpu_count() or 1
+        segments = self.segments_per_scene or -(-max_workers // len(scenes))
+        processor = self.video_processor
+        # Compile each render plan once; workers load it from metadata/
+        for scene_data in scenes:
+            processor.prepare_render_plan(scene_data)
+        scene_ranges = [processor.segment_ranges(scene_data, segments) for scene_data in scenes]
+        job_count = sum(len(ranges) for ranges in scene_ranges)
+
+        workers = min(max_workers, job_count)
+        if workers <= 1:
+            return [await self.create_scene_video(scene_data) for scene_data in scenes]
+
+        logger.info(f"Rendering {len(scenes)} scenes as {job_count} jobs with {workers} worker processes")
+        loop = asyncio.get_running_loop()
+        # Spawn rather than fork: the pipeline runs on a background thread of the web app
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+            # Tracks are rasterized once up front rather than by every worker that draws them
+            await processor.warm_sprite_tracks(scenes, pool)
+            scene_futures = []
+            for scene_data, ranges in zip(scenes, scene_ranges):
+                output_path = processor.scene_video_path(scene_data)
+                futures = []
+                for i, (start_frame, end_frame) in enumerate(ranges):
+                    part_path = output_path if len(ranges) == 1 else processor.segment_path(output_path, i)
+                    futures.append(loop.run_in_executor(
+                        pool,
+                        render_scene_segment,
+                        str(self.asset_manager.run_dir),
+                        scene_data,
+                        str(part_path),
+                        start_frame,
+                        end_frame,
+                        processor.worker_options()
+                    ))
+                scene_futures.append((scene_data, output_path, futures))
+
+            async def finish_scene(scene_data, output_path, futures):
+                # A scene is stitched as soon as its own segments are done
+                part_paths = await asyncio.gather(*futures)
+                if len(part_paths) == 1:
+                    return Path(part_paths[0])
+                audio_path = RenderPlan.audio_path(scene_data)
+                return Path(await processor.concat_segments(part_paths, output_path, audio_path))
+
+            video_paths = await asyncio.gather(*(finish_scene(*scene) for scene in scene_futures))
+
+        return list(video_paths)
 
     async def _compose_scene(self, scene: Dict, assets: Dict, timeline=None) -> str:
         # This method now only creates the background and optional effects.
@@ -201,11 +259,8 @@ class SceneComposer:
             background_group.add(background)
             dwg.add(background_group)
 
+            # Ambient particle effects are drawn by the video compositor (see particles.py)
             effects_group = dwg.g(id="effects_layer")
-            if scene.get("ambient_effects"):
-                particle_effect = self._create_particle_effect(duration=5, delay=0)
-                effects_group.add(particle_effect)
-
             dwg.add(effects_group)
 
             svg_string = dwg.tostring()
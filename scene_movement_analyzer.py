@@ -23,6 +23,8 @@ class CharacterMovement:
     start_scale: float
     end_scale: float
     animation_name: Optional[str] = None
+    # Sample rate override for this movement's animation (None = scene default)
+    animation_fps: Optional[float] = None
 
     def to_dict(self):
         return {
@@ -33,7 +35,8 @@ class CharacterMovement:
             "end_position": list(self.end_position),
             "start_scale": self.start_scale,
             "end_scale": self.end_scale,
-            "animation_name": self.animation_name
+            "animation_name": self.animation_name,
+            "animation_fps": self.animation_fps
         }
 
 @dataclass
@@ -43,6 +46,11 @@ class SceneTimeline:
     background_path: str
     narration_text: str
     movements: List[CharacterMovement]
+    # Per-scene animation sample rates (None = render_plan.RenderPlan defaults)
+    idle_fps: Optional[float] = None
+    animation_fps: Optional[float] = None
+    # Ambient particle count (None = the story scene's, else ParticleSystem.DEFAULT_COUNT)
+    particle_count: Optional[int] = None
 
     def to_dict(self):
         return {
@@ -50,7 +58,10 @@ class SceneTimeline:
             "duration": self.duration,
             "background_path": self.background_path,
             "narration_text": self.narration_text,
-            "movements": [m.to_dict() for m in self.movements]
+            "movements": [m.to_dict() for m in self.movements],
+            "idle_fps": self.idle_fps,
+            "animation_fps": self.animation_fps,
+            "particle_count": self.particle_count
         }
 
 # Define Pydantic models for structured parsing
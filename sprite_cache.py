@@ -0,0 +1,133 @@
+import hashlib
+import logging
+from typing import Hashable, List, Optional, Sequence, Tuple
+
+import numpy as np
+from PIL import Image
+
+from frame_cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+class SpriteCache:
+    """
+    Scaled character sprites keyed by (character, animation, frame, size).
+
+    Scales are quantized to the whole-pixel output size (see scaled_size), so
+    every frame that draws the same sprite frame at the same on-screen size
+    reuses one resize, and frames already rasterized at that size are used
+    as they are.
+    With mipmaps enabled, large downscales start from the closest
+    half-resolution level of the source frame instead of the full raster.
+    """
+
+    # Default memory for scaled sprites (about 256 half-size 1024x1024 frames)
+    DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+    def __init__(self, max_bytes: Optional[int] = DEFAULT_MAX_BYTES, mipmaps: bool = False):
+        self.mipmaps = mipmaps
+        self.sprites = LRUCache(max_bytes=max_bytes)
+        self.levels = LRUCache(max_bytes=max_bytes)
+        self.resizes = 0
+
+    @staticmethod
+    def scaled_size(width: int, height: int, scale: float) -> Tuple[int, int]:
+        return int(width * scale), int(height * scale)
+
+    def get(self, key: Hashable, frame: np.ndarray, size: Tuple[int, int]) -> np.ndarray:
+        """
+        Return `frame` (a premultiplied RGBA array identified by `key`)
+        resized to `size` (width, height), resizing only on a cache miss.
+        """
+        if frame.shape[1] == size[0] and frame.shape[0] == size[1]:
+            return frame
+        sprite_key = (key, size)
+        sprite = self.sprites.get(sprite_key)
+        if sprite is None:
+            sprite = self._resize(key, frame, size)
+            self.sprites.put(sprite_key, sprite, sprite.nbytes)
+        return sprite
+
+    def _resize(self, key: Hashable, frame: np.ndarray, size: Tuple[int, int]) -> np.ndarray:
+        source = frame
+        if self.mipmaps:
+            source = self._closest_level(key, frame, size)
+        self.resizes += 1
+        # Resample in premultiplied space so edges don't pick up dark fringes
+        ch, cw = source.shape[:2]
+        img = Image.frombuffer('RGBa', (cw, ch), source, 'raw', 'RGBa', 0, 1)
+        sprite = np.array(img.resize(size, Image.LANCZOS))
+        # LANCZOS overshoots, leaving colour above alpha (even at alpha 0);
+        # clamp back to valid premultiplied pixels so blending is exact
+        np.minimum(sprite[..., :3], sprite[..., 3:], out=sprite[..., :3])
+        return sprite
+
+    def _closest_level(self, key: Hashable, frame: np.ndarray, size: Tuple[int, int]) -> np.ndarray:
+        """Smallest mipmap level that is still at least as large as the target size"""
+        levels = self._levels(key, frame)
+        best = levels[0]
+        for level in levels[1:]:
+            if level.shape[1] < size[0] or level.shape[0] < size[1]:
+                break
+            best = level
+        return best
+
+    def _levels(self, key: Hashable, frame: np.ndarray) -> List[np.ndarray]:
+        levels = self.levels.get(key)
+        if levels is not None:
+            return levels
+        levels = [frame]
+        level = frame
+        while min(level.shape[:2]) >= 64:
+            ch, cw = level.shape[:2]
+            img = Image.frombuffer('RGBa', (cw, ch), level, 'raw', 'RGBa', 0, 1)
+            level = np.asarray(img.reduce(2))
+            levels.append(level)
+        # The full-size frame is owned by the caller, only the reduced levels cost memory
+        self.levels.put(key, levels, sum(l.nbytes for l in levels[1:]))
+        return levels
+
+    def stats(self) -> str:
+        return f"{self.sprites.stats()}, {self.resizes} resizes"
+
+
+class SpriteStore:
+    """
+    Store of rendered sprite track frames, shared by the scenes one
+    VideoProcessor renders.
+
+    Frames are keyed by a hash of the SVG content plus the duration, frame
+    rate, raster size and animation sample rate they were rendered for, so
+    a character animation that appears in several scenes rendered by the
+    same process is rasterized once and the same frame sequence is handed
+    to every scene that uses it.
+
+    The store lives in one process. Render workers each have their own;
+    across workers tracks are shared through the persistent raster cache,
+    which VideoProcessor.warm_sprite_tracks fills before scenes fan out.
+    With the raster cache disabled, every worker rasterizes the tracks it
+    draws.
+    """
+
+    # Default memory for stored frame sequences
+    DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+
+    def __init__(self, max_bytes: Optional[int] = DEFAULT_MAX_BYTES):
+        self.frames = LRUCache(max_bytes=max_bytes)
+
+    @staticmethod
+    def key(svg_data: str, duration: float, fps: int, size: Tuple[int, int],
+            sample_fps: Optional[float] = None) -> Tuple:
+        digest = hashlib.sha256(svg_data.encode('utf-8')).hexdigest()
+        return digest, round(duration, 6), fps, tuple(size), sample_fps
+
+    def get(self, key: Hashable) -> Optional[Sequence[np.ndarray]]:
+        return self.frames.get(key)
+
+    def put(self, key: Hashable, frames: Sequence[np.ndarray]):
+        # Looping sequences repeat references to the same arrays; count each once
+        distinct = {id(frame): frame.nbytes for frame in frames}
+        self.frames.put(key, frames, sum(distinct.values()))
+
+    def stats(self) -> str:
+        return self.frames.stats()
@@ -0,0 +1,480 @@
+import copy
+import logging
+import math
+import re
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+from lxml import etree
+from PIL import Image
+
+from blending import blend_over
+
+logger = logging.getLogger(__name__)
+
+# Elements that never paint by themselves; they are kept in every layer document
+NON_RENDERING_TAGS = {
+    'defs', 'linearGradient', 'radialGradient', 'pattern', 'clipPath', 'mask',
+    'filter', 'marker', 'symbol', 'style', 'script', 'title', 'desc', 'metadata'
+}
+# Referenced content whose animation changes how other elements are painted
+PAINT_SERVER_TAGS = NON_RENDERING_TAGS - {'defs', 'style', 'script', 'title', 'desc', 'metadata'}
+# animateTransform types that can be replayed by transforming a raster
+AFFINE_TYPES = {'translate', 'scale', 'rotate', 'skewX', 'skewY'}
+# Attributes on an ancestor that make its children's layers depend on each other
+GROUP_EFFECT_ATTRIBUTES = ('filter', 'mask', 'clip-path')
+
+MAX_USE_DEPTH = 8
+
+_TRANSFORM_RE = re.compile(r'(matrix|translate|scale|rotate|skewX|skewY)\s*\(([^)]*)\)')
+_XLINK_HREF = '{http://www.w3.org/1999/xlink}href'
+
+
+def _localname(elem) -> str:
+    return etree.QName(elem).localname
+
+
+def _presentation(elem, name: str) -> Optional[str]:
+    """Value of a presentation attribute, set directly or through the style attribute"""
+    for declaration in (elem.get('style') or '').split(';'):
+        key, _, value = declaration.partition(':')
+        if key.strip() == name:
+            return value.strip()
+    return elem.get(name)
+
+
+def _is_transparent_group(elem) -> bool:
+    """True when the element can be split into layers without changing how it paints"""
+    opacity = _presentation(elem, 'opacity')
+    if opacity is not None:
+        try:
+            if float(opacity) < 1.0:
+                return False
+        except ValueError:
+            return False
+    return all(_presentation(elem, name) in (None, 'none') for name in GROUP_EFFECT_ATTRIBUTES)
+
+
+def parse_transform(transform: Optional[str]) -> np.ndarray:
+    """Parse an SVG transform list into a 3x3 matrix; raises ValueError if unsupported"""
+    matrix = np.eye(3)
+    if not transform or not transform.strip():
+        return matrix
+    position = 0
+    for match in _TRANSFORM_RE.finditer(transform):
+        if transform[position:match.start()].strip(' \t\r\n,'):
+            raise ValueError(f"Unsupported transform: {transform}")
+        position = match.end()
+        name = match.group(1)
+        values = [float(v) for v in re.split(r'[\s,]+', match.group(2).strip()) if v]
+        if name == 'matrix' and len(values) == 6:
+            a, b, c, d, e, f = values
+            op = np.array([[a, c, e], [b, d, f], [0, 0, 1]])
+        elif name == 'translate' and len(values) in (1, 2):
+            tx, ty = values[0], values[1] if len(values) == 2 else 0.0
+            op = np.array([[1, 0, tx], [0, 1, ty], [0, 0, 1]])
+        elif name == 'scale' and len(values) in (1, 2):
+            sx, sy = values[0], values[1] if len(values) == 2 else values[0]
+            op = np.diag([sx, sy, 1.0])
+        elif name == 'rotate' and len(values) in (1, 3):
+            angle = math.radians(values[0])
+            cx, cy = values[1:] if len(values) == 3 else (0.0, 0.0)
+            cos, sin = math.cos(angle), math.sin(angle)
+            op = np.array([
+                [cos, -sin, cx - cos * cx + sin * cy],
+                [sin, cos, cy - sin * cx - cos * cy],
+                [0, 0, 1]
+            ])
+        elif name == 'skewX' and len(values) == 1:
+            op = np.array([[1, math.tan(math.radians(values[0])), 0], [0, 1, 0], [0, 0, 1]])
+        elif name == 'skewY' and len(values) == 1:
+            op = np.array([[1, 0, 0], [math.tan(math.radians(values[0])), 1, 0], [0, 0, 1]])
+        else:
+            raise ValueError(f"Unsupported transform: {transform}")
+        matrix = matrix @ op
+    if transform[position:].strip(' \t\r\n,'):
+        raise ValueError(f"Unsupported transform: {transform}")
+    return matrix
+
+
+@dataclass
+class Layer:
+    """One separately rasterized slice of the SVG, in paint order"""
+    kind: str  # "static", "affine" or "dynamic"
+    document: Optional[etree._Element] = None
+    # (element in the layer document, element in the source tree, attribute)
+    syncs: List[Tuple[etree._Element, etree._Element, str]] = field(default_factory=list)
+    raster: Optional[np.ndarray] = None
+    offset: Tuple[int, int] = (0, 0)
+    # Affine layers: the animated element in the source tree and the matrices
+    # mapping its transform to device pixels
+    target: Optional[etree._Element] = None
+    to_device: Optional[np.ndarray] = None
+    from_reference: Optional[np.ndarray] = None
+
+
+class LayeredRenderer:
+    """
+    Renders animation frames of an SVG from pre-rasterized layers.
+
+    The document is split, in paint order, into static layers and animated
+    subtrees. Static layers are rasterized once. Subtrees whose only
+    animation is an affine animateTransform are rasterized once too and
+    drawn each frame with an affine blit; any other animated subtree is
+    re-rasterized on its own. Documents without any transform-only group
+    are left to whole-frame rasterization. <use> references are expanded so animated
+    content drawn through <defs> can be layered as well.
+    """
+
+    def __init__(self, layers: List[Layer], size: Tuple[int, int],
+                 rasterize: Callable[[bytes], Tuple[np.ndarray, np.ndarray]]):
+        self.layers = layers
+        self.size = size
+        self._rasterize = rasterize
+
+    @classmethod
+    def build(cls, root: etree._Element, tracks, track_values, apply_row: Callable[[int], None],
+              rasterize: Callable[[bytes], Tuple[np.ndarray, np.ndarray]],
+              size: Tuple[int, int]) -> Optional["LayeredRenderer"]:
+        """
+        Split the document rooted at `root` into layers, or return None when
+        it cannot be layered exactly (the caller then rasterizes whole frames).
+
+        `rasterize` turns SVG bytes into (premultiplied RGBA array of `size`
+        (width, height), 3x3 matrix from root user units to device pixels). `apply_row(i)` sets the
+        animated attributes of `root` to their values for rendered frame i,
+        one row of `track_values`.
+        """
+        if not tracks:
+            return None
+        try:
+            return cls._build(root, tracks, track_values, apply_row, rasterize, size)
+        except ValueError as e:
+            logger.info(f"Rasterizing whole frames: {e}")
+            return None
+
+    @classmethod
+    def _build(cls, root, tracks, track_values, apply_row, rasterize, size):
+        expanded, origin = _expand_uses(root)
+        in_non_rendering = _non_rendering_elements(expanded)
+        order = {elem: i for i, elem in enumerate(expanded.iter(tag=etree.Element))}
+
+        # Copies of each animated source element that are actually painted
+        tracked = {}
+        copies_by_source = {}
+        for elem in expanded.iter(tag=etree.Element):
+            copies_by_source.setdefault(origin[elem], []).append(elem)
+        for track in tracks:
+            for elem in copies_by_source.get(track.target, []):
+                if elem in in_non_rendering:
+                    if any(_localname(a) in PAINT_SERVER_TAGS for a in _self_and_ancestors(elem)):
+                        raise ValueError("animated paint server, clip path, mask or marker")
+                    # Unreferenced content under <defs> never paints
+                    continue
+                tracked.setdefault(elem, []).append(track)
+
+        if not tracked:
+            raise ValueError("no painted element is animated")
+
+        # Each outermost animated element becomes a layer
+        roots = sorted(
+            (elem for elem in tracked
+             if not any(a in tracked for a in _self_and_ancestors(elem)[1:])),
+            key=order.get
+        )
+        for layer_root in roots:
+            if layer_root is expanded:
+                raise ValueError("the root element is animated")
+            for ancestor in _self_and_ancestors(layer_root)[1:]:
+                # Nested viewports and <switch> change what their children paint
+                allowed = ('svg',) if ancestor is expanded else ('g', 'a')
+                if _localname(ancestor) not in allowed:
+                    raise ValueError(f"animated content inside <{_localname(ancestor)}>")
+                if not _is_transparent_group(ancestor):
+                    raise ValueError("animated content inside a group with opacity, filter, mask or clip-path")
+
+        root_set = set(roots)
+        ancestors_of_roots = set()
+        for layer_root in roots:
+            ancestors_of_roots.update(_self_and_ancestors(layer_root)[1:])
+
+        def layer_root_of(elem):
+            for a in _self_and_ancestors(elem):
+                if a in root_set:
+                    return a
+            return None
+
+        # Painted elements outside every animated subtree, grouped by how many
+        # animated subtrees precede them in paint order
+        segments = {}
+        for elem in expanded.iter(tag=etree.Element):
+            if elem in in_non_rendering or elem in ancestors_of_roots or layer_root_of(elem) is not None:
+                continue
+            preceding = sum(1 for r in roots if order[r] < order[elem])
+            segments.setdefault(preceding, []).append(elem)
+
+        layers = []
+        for i in range(len(roots) + 1):
+            if segments.get(i):
+                removed = list(roots)
+                removed += [e for k, elems in segments.items() if k != i for e in elems]
+                document, _ = _layer_document(expanded, removed)
+                layers.append(Layer(kind="static", document=document))
+            if i < len(roots):
+                layer_root = roots[i]
+                removed = [r for r in roots if r is not layer_root]
+                removed += [e for elems in segments.values() for e in elems]
+                document, copies = _layer_document(expanded, removed)
+                syncs = [
+                    (copies[elem], origin[elem], track.attribute)
+                    for elem, elem_tracks in tracked.items() if layer_root_of(elem) is layer_root
+                    for track in elem_tracks
+                ]
+                layer = Layer(kind="dynamic", document=document, syncs=syncs)
+                if cls._is_affine(layer_root, tracked, layer_root_of):
+                    try:
+                        layer.to_device = _ancestor_transform(layer_root)
+                        layer.target = origin[layer_root]
+                        layer.kind = "affine"
+                    except ValueError:
+                        pass
+                layers.append(layer)
+
+        for layer in layers:
+            if layer.kind == "affine":
+                cls._prepare_affine(layer, track_values, apply_row, rasterize)
+        if not any(layer.kind == "affine" for layer in layers):
+            # Splitting only pays off when some animated group can be blitted
+            raise ValueError("no animated group can be drawn from a single raster")
+
+        for layer in layers:
+            if layer.kind == "static":
+                raster, _ = rasterize(_serialize(layer.document))
+                layer.raster, layer.offset = _crop(raster)
+                layer.document = None
+        layers = [l for l in layers if l.kind != "static" or l.raster is not None]
+
+        counts = {kind: sum(1 for l in layers if l.kind == kind) for kind in ("static", "affine", "dynamic")}
+        logger.info(f"Layered rendering: {counts['static']} static, {counts['affine']} transform-only "
+                    f"and {counts['dynamic']} re-rasterized layers")
+        return cls(layers, size, rasterize)
+
+    @staticmethod
+    def _is_affine(layer_root, tracked, layer_root_of) -> bool:
+        """True when the subtree's only animation is an affine transform of its root"""
+        if any(elem is not layer_root and layer_root_of(elem) is layer_root for elem in tracked):
+            return False
+        if layer_root.get('transform-origin') is not None:
+            return False
+        return all(t.attribute == 'transform' and t.transform_type in AFFINE_TYPES
+                   for t in tracked[layer_root])
+
+    @staticmethod
+    def _prepare_affine(layer: Layer, track_values, apply_row, rasterize):
+        """Rasterize an affine layer once, at the frame where it is drawn largest"""
+        row_count = min(len(values) for values in track_values)
+        transforms = []
+        for row in range(row_count):
+            apply_row(row)
+            try:
+                transforms.append(parse_transform(layer.target.get('transform')))
+            except ValueError:
+                layer.kind = "dynamic"
+                return
+        reference = max(range(row_count), key=lambda r: abs(np.linalg.det(transforms[r][:2, :2])))
+        if abs(np.linalg.det(transforms[reference][:2, :2])) < 1e-9:
+            layer.kind = "dynamic"
+            return
+
+        apply_row(reference)
+        for copy_elem, source_elem, attribute in layer.syncs:
+            copy_elem.set(attribute, source_elem.get(attribute))
+        raster, viewport = rasterize(_serialize(layer.document))
+        alpha = raster[..., 3]
+        if alpha[0].any() or alpha[-1].any() or alpha[:, 0].any() or alpha[:, -1].any() or not alpha.any():
+            # Content may be clipped by the canvas in this frame and visible in others
+            layer.kind = "dynamic"
+            return
+
+        layer.to_device = viewport @ layer.to_device
+        layer.from_reference = np.linalg.inv(layer.to_device @ transforms[reference])
+        layer.raster, layer.offset = _crop(raster)
+        layer.document = None
+        layer.syncs = []
+
+    def render(self) -> np.ndarray:
+        """Compose the frame for the current attribute values of the source tree"""
+        width, height = self.size
+        frame = np.zeros((height, width, 4), dtype=np.uint8)
+        for layer in self.layers:
+            if layer.kind == "dynamic":
+                for copy_elem, source_elem, attribute in layer.syncs:
+                    copy_elem.set(attribute, source_elem.get(attribute))
+                raster, _ = self._rasterize(_serialize(layer.document))
+                raster, offset = _crop(raster)
+                if raster is not None:
+                    self._blit(frame, raster, offset, None)
+            elif layer.kind == "static":
+                self._blit(frame, layer.raster, layer.offset, None)
+            else:
+                transform = parse_transform(layer.target.get('transform'))
+                mapping = layer.to_device @ transform @ layer.from_reference
+                self._blit(frame, layer.raster, layer.offset, mapping)
+        return frame
+
+    def _blit(self, frame: np.ndarray, raster: np.ndarray, offset: Tuple[int, int],
+              mapping: Optional[np.ndarray]):
+        """Composite a cropped raster onto the frame, transformed by a 3x3 pixel mapping"""
+        height, width = frame.shape[:2]
+        rh, rw = raster.shape[:2]
+        ox, oy = offset
+        translation = None
+        if mapping is None:
+            translation = (0.0, 0.0)
+        elif np.allclose(mapping[:2, :2], np.eye(2), atol=1e-9):
+            translation = (mapping[0, 2], mapping[1, 2])
+
+        if translation is not None and all(abs(t - round(t)) < 1e-6 for t in translation):
+            # Whole-pixel moves are plain copies
+            x, y = ox + int(round(translation[0])), oy + int(round(translation[1]))
+            x1, y1 = max(0, x), max(0, y)
+            x2, y2 = min(width, x + rw), min(height, y + rh)
+            if x2 > x1 and y2 > y1:
+                blend_over(frame[y1:y2, x1:x2], raster[y1 - y:y2 - y, x1 - x:x2 - x])
+            return
+
+        # Bounding box of the transformed raster on the frame
+        corners = np.array([[ox, ox + rw, ox, ox + rw], [oy, oy, oy + rh, oy + rh], [1, 1, 1, 1]], dtype=np.float64)
+        moved = mapping @ corners
+        x1 = max(0, int(math.floor(moved[0].min())))
+        y1 = max(0, int(math.floor(moved[1].min())))
+        x2 = min(width, int(math.ceil(moved[0].max())))
+        y2 = min(height, int(math.ceil(moved[1].max())))
+        if x2 <= x1 or y2 <= y1:
+            return
+        # Pillow maps output pixel coordinates back to input coordinates
+        inverse = np.linalg.inv(mapping)
+        to_source = np.array([[1, 0, -ox], [0, 1, -oy], [0, 0, 1]]) @ inverse @ np.array([[1, 0, x1], [0, 1, y1], [0, 0, 1]])
+        source = Image.frombuffer('RGBa', (rw, rh), np.ascontiguousarray(raster), 'raw', 'RGBa', 0, 1)
+        moved_image = source.transform(
+            (x2 - x1, y2 - y1), Image.AFFINE,
+            data=tuple(to_source[:2].flatten()),
+            resample=Image.BILINEAR
+        )
+        blend_over(frame[y1:y2, x1:x2], np.asarray(moved_image))
+
+
+def _self_and_ancestors(elem) -> List[etree._Element]:
+    chain = []
+    while elem is not None:
+        chain.append(elem)
+        elem = elem.getparent()
+    return chain
+
+
+def _non_rendering_elements(root) -> set:
+    """Elements that are, or are inside, a non-rendering element such as <defs>"""
+    result = set()
+    for elem in root.iter(tag=etree.Element):
+        parent = elem.getparent()
+        if _localname(elem) in NON_RENDERING_TAGS or (parent is not None and parent in result):
+            result.add(elem)
+    return result
+
+
+def _expand_uses(root) -> Tuple[etree._Element, Dict]:
+    """
+    Copy the document with every painted <use> replaced by a <g> holding a
+    copy of the referenced element. Returns the copy and a map from each of
+    its elements to the source element it was copied from.
+    """
+    expanded = copy.deepcopy(root)
+    origin = dict(zip(expanded.iter(tag=etree.Element), root.iter(tag=etree.Element)))
+
+    for _ in range(MAX_USE_DEPTH):
+        in_non_rendering = _non_rendering_elements(expanded)
+        uses = [e for e in expanded.iter(tag=etree.Element)
+                if _localname(e) == 'use' and e not in in_non_rendering]
+        if not uses:
+            return expanded, origin
+        ids = {}
+        for elem in expanded.iter(tag=etree.Element):
+            if elem.get('id') is not None:
+                ids.setdefault(elem.get('id'), elem)
+        for use in uses:
+            href = use.get('href') or use.get(_XLINK_HREF) or ''
+            referenced = ids.get(href[1:]) if href.startswith('#') else None
+            if referenced is None:
+                # Nothing is drawn for a dangling reference
+                use.getparent().remove(use)
+                continue
+            if _localname(referenced) in ('svg', 'symbol'):
+                raise ValueError(f"<use> of a <{_localname(referenced)}>")
+            if not _is_transparent_group(use):
+                raise ValueError("<use> with opacity, filter or clip-path")
+            try:
+                x = float((use.get('x') or '0').replace('px', ''))
+                y = float((use.get('y') or '0').replace('px', ''))
+            except ValueError:
+                raise ValueError("<use> position with units")
+
+            # The <use> becomes a group (which animations of the <use> target)
+            # around the x/y offset and a copy of the referenced element
+            tag = f"{{{etree.QName(use).namespace}}}g" if etree.QName(use).namespace else 'g'
+            group = etree.Element(tag)
+            for name, value in use.attrib.items():
+                # cairosvg ignores masks on <use>
+                if name not in ('href', _XLINK_HREF, 'x', 'y', 'width', 'height', 'id', 'mask'):
+                    group.set(name, value)
+            instance = copy.deepcopy(referenced)
+            for copied, source in zip(instance.iter(tag=etree.Element), referenced.iter(tag=etree.Element)):
+                origin[copied] = origin[source]
+            if x or y:
+                offset = etree.SubElement(group, tag, transform=f"translate({x:g},{y:g})")
+                offset.append(instance)
+                origin[offset] = None
+            else:
+                group.append(instance)
+            # Animation elements of the <use> stay with its group
+            for child in list(use):
+                group.insert(0, child)
+            group.tail = use.tail
+            use.getparent().replace(use, group)
+            origin[group] = origin[use]
+    raise ValueError("<use> references nested too deeply")
+
+
+def _layer_document(expanded, removed) -> Tuple[etree._Element, Dict]:
+    """Copy the expanded document without the given elements; returns the copy and an element map"""
+    document = copy.deepcopy(expanded)
+    copies = dict(zip(expanded.iter(tag=etree.Element), document.iter(tag=etree.Element)))
+    for elem in removed:
+        copied = copies[elem]
+        parent = copied.getparent()
+        if parent is not None:
+            parent.remove(copied)
+    return document, copies
+
+
+def _ancestor_transform(elem) -> np.ndarray:
+    """Combined transform of the element's ancestors (root user units to the element's parent)"""
+    matrix = np.eye(3)
+    for ancestor in reversed(_self_and_ancestors(elem)[1:]):
+        matrix = matrix @ parse_transform(ancestor.get('transform'))
+    return matrix
+
+
+def _crop(raster: np.ndarray) -> Tuple[Optional[np.ndarray], Tuple[int, int]]:
+    """Crop a raster to its visible pixels; returns (None, (0, 0)) if it is empty"""
+    alpha = raster[..., 3]
+    rows = np.nonzero(alpha.any(axis=1))[0]
+    if len(rows) == 0:
+        return None, (0, 0)
+    cols = np.nonzero(alpha.any(axis=0))[0]
+    y1, y2, x1, x2 = rows[0], rows[-1] + 1, cols[0], cols[-1] + 1
+    return np.ascontiguousarray(raster[y1:y2, x1:x2]), (int(x1), int(y1))
+
+
+def _serialize(document) -> bytes:
+    return etree.tostring(document, encoding='utf-8', method='xml')
@@ -1,8 +1,18 @@
 import re
-import tempfile
+import math
+from collections.abc import Sequence
+from dataclasses import dataclass
+from fractions import Fraction
 from pathlib import Path
+from typing import Optional
 import logging
 
+import numpy as np
+
+from frame_cache import LRUCache
+from rasterizers import Rasterizer, get_rasterizer
+from svg_layers import LayeredRenderer
+
 logger = logging.getLogger(__name__)
 
 try:
@@ -12,29 +22,243 @@ except ImportError as e:
     logger.error(f"Failed to import lxml.etree: {e}")
     raise
 
-try:
-    import cairosvg
-    logger.info("Successfully imported cairosvg")
-except ImportError as e:
-    logger.error(f"Failed to import cairosvg: {e}")
-    raise
+_NUMBER_RE = re.compile(r'[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?')
+_NUMERIC_LIST_RE = re.compile(
+    r'\s*{num}(?:(?:\s*,\s*|\s+){num})*\s*'.format(num=_NUMBER_RE.pattern)
+)
+
+# How animateTransform values are written back, keyed by (type, value count)
+_TRANSFORM_FORMATS = {
+    'translate': {1: "translate({0})", 2: "translate({0},{1})"},
+    'scale': {1: "scale({0})", 2: "scale({0},{1})"},
+    'rotate': {1: "rotate({0})", 3: "rotate({0} {1} {2})"},
+    'skewX': {1: "skewX({0})"},
+    'skewY': {1: "skewY({0})"},
+}
+
+
+@dataclass
+class AnimationTrack:
+    """An <animate>/<animateTransform> element compiled into keyframe arrays"""
+    target: etree._Element
+    attribute: str
+    transform_type: Optional[str]
+    key_times: np.ndarray
+    keyframes: np.ndarray
+    begin: float
+    duration: float
+    repeat_count: Optional[float]
+    freeze: bool
+
+    def progress(self, times):
+        """Normalized progress (0..1) of the animation at each of the given times"""
+        local_time = times - self.begin
+        progress = np.mod(local_time, self.duration) / self.duration
+        # Before begin the animation sits at its first value
+        progress[local_time < 0] = 0.0
+        if self.repeat_count is not None:
+            # Once ended, hold the last value (fill="freeze") or fall back to the first
+            ended = local_time >= self.duration * self.repeat_count
+            if self.freeze:
+                remainder = self.repeat_count % 1.0
+                progress[ended] = remainder if remainder else 1.0
+            else:
+                progress[ended] = 0.0
+        return progress
+
+    def evaluate(self, times):
+        """Interpolated keyframe values at each time, shape (len(times), k)"""
+        progress = self.progress(times)
+        index = np.searchsorted(self.key_times, progress, side='right') - 1
+        index = np.clip(index, 0, len(self.key_times) - 2)
+        start_time = self.key_times[index]
+        span = self.key_times[index + 1] - start_time
+        factor = np.divide(progress - start_time, span, out=np.ones_like(progress), where=span > 0)
+        factor = np.clip(factor, 0.0, 1.0)[:, None]
+        start = self.keyframes[index]
+        return start + (self.keyframes[index + 1] - start) * factor
+
+    def format_value(self, values):
+        """Format one row of evaluated values as an attribute string"""
+        parts = [f"{v:g}" for v in values]
+        if self.transform_type is None:
+            return " ".join(parts)
+        formats = _TRANSFORM_FORMATS[self.transform_type]
+        fmt = formats.get(len(parts))
+        if fmt is None:
+            return f"{self.transform_type}({' '.join(parts)})"
+        return fmt.format(*parts)
+
+
+# Frames are either PNG bytes or uint8 arrays of premultiplied RGBA pixels
+FRAME_FORMATS = ("png", "array")
+
+
+class LoopedFrames(Sequence):
+    """Frame sequence backed by a rendered lead-in plus a single loop period.
+
+    Frames past the lead-in repeat with the given period, so indexing returns
+    references to the already rendered frames instead of new copies. Within
+    the rendered frames, `sources` may map a frame to an earlier one with the
+    identical animation state.
+    """
+
+    def __init__(self, frames, lead_in: int, period: int, length: int, sources=None):
+        self._frames = frames
+        self.lead_in = lead_in
+        self.period = period
+        self._length = length
+        self._sources = sources
+
+    def __len__(self):
+        return self._length
+
+    def source_index(self, index: int) -> int:
+        """Map a frame index to the index of the rendered frame it reuses"""
+        if index >= self.lead_in:
+            index = self.lead_in + (index - self.lead_in) % self.period
+        if self._sources is not None:
+            index = int(self._sources[index])
+        return index
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self._length))]
+        if index < 0:
+            index += self._length
+        if not 0 <= index < self._length:
+            raise IndexError("frame index out of range")
+        return self._get_source(self.source_index(index))
+
+    def _get_source(self, source_index: int):
+        return self._frames[source_index]
+
+
+class LazyFrames(LoopedFrames):
+    """Frame sequence that rasterizes frames on first access.
+
+    At most max_cached rendered frames are kept in an LRU cache, so memory
+    stays bounded no matter how long the sequence is.
+    """
+
+    def __init__(self, render, lead_in: int, period: int, length: int, max_cached: int, sources=None):
+        super().__init__(None, lead_in, period, length, sources)
+        self._render = render
+        self.cache = LRUCache(None if max_cached is None else max(1, max_cached))
+
+    def _get_source(self, source_index: int):
+        frame = self.cache.get(source_index)
+        if frame is None:
+            frame = self._render(source_index)
+            self.cache.put(source_index, frame)
+        return frame
+
+
+def frame_source_index(frames, index: int) -> int:
+    """Index of the rendered frame that frame `index` of a frame sequence shows"""
+    if isinstance(frames, LoopedFrames):
+        return frames.source_index(index)
+    return index
+
 
 class SVGProcessor:
-    def __init__(self, svg_path):
+    # Longest loop period (in seconds) we are willing to render for frame reuse
+    MAX_LOOP_SECONDS = 10.0
+    # Default (square) raster size; also the viewport percentages resolve against
+    OUTPUT_SIZE = 1024
+    # Bump whenever a change here alters rendered pixels, to invalidate persistent raster caches
+    RENDER_VERSION = 1
+
+    def __init__(self, svg_path=None, layered=True, svg_string=None, rasterizer=None):
+        """
+        The SVG is read from svg_path, or parsed from svg_string when given
+        (no file needed). layered renders array frames from pre-rasterized
+        static layers and transform-only animated groups where the SVG allows
+        it (see svg_layers.LayeredRenderer); False rasterizes every frame in
+        full. rasterizer is a Rasterizer or the registered name of one
+        (default cairosvg, see rasterizers.py).
+        """
+        if (svg_path is None) == (svg_string is None):
+            raise ValueError("Pass exactly one of svg_path and svg_string")
         self.svg_path = svg_path
+        self.svg_string = svg_string
+        self.layered = layered
+        if not isinstance(rasterizer, Rasterizer):
+            rasterizer = get_rasterizer(rasterizer)
+        self.rasterizer = rasterizer
         self.tree = None
+        self.tracks = []
+        self._layered_renderers = {}
         self._load_svg()
 
+    @classmethod
+    def rasterizer_version(cls, layered=True, rasterizer=None):
+        """Identifies the renderer that produced a frame, for keying persistent raster caches"""
+        if not isinstance(rasterizer, Rasterizer):
+            rasterizer = get_rasterizer(rasterizer)
+        mode = "layered" if layered and rasterizer.supports_layers else "full"
+        return f"{rasterizer.version}/{mode}/{cls.RENDER_VERSION}"
+
     def _load_svg(self):
-        """Load and parse SVG file"""
+        """Load and parse the SVG file or string"""
         try:
             parser = etree.XMLParser(remove_blank_text=True)
-            self.tree = etree.parse(self.svg_path, parser)
-            logger.info(f"Successfully loaded SVG file: {self.svg_path}")
+            if self.svg_string is not None:
+                svg_bytes = self.svg_string.encode('utf-8') if isinstance(self.svg_string, str) else self.svg_string
+                self.tree = etree.ElementTree(etree.fromstring(svg_bytes, parser))
+            else:
+                self.tree = etree.parse(self.svg_path, parser)
+            self.tracks = self._compile_tracks()
+            source = self.svg_path if self.svg_path is not None else "in-memory SVG"
+            logger.info(f"Successfully loaded SVG file: {source} ({len(self.tracks)} animation tracks)")
         except Exception as e:
             logger.error(f"Failed to load SVG file: {str(e)}")
             raise
 
+    @staticmethod
+    def _parse_clock_value(value_str):
+        """Parse a SMIL clock value such as '1.2s' or '500ms' into seconds"""
+        if not value_str:
+            return None
+        value_str = value_str.strip()
+        try:
+            if value_str.endswith('ms'):
+                return float(value_str[:-2]) / 1000
+            if value_str.endswith('s'):
+                return float(value_str[:-1])
+            return float(value_str)
+        except ValueError:
+            # 'indefinite', event or syncbase values
+            return None
+
+    def _animation_timing(self, elem):
+        """Return (begin, duration, repeat_count, freeze) for an animation element.
+
+        repeat_count is None for animations that loop indefinitely.
+        """
+        duration = self._parse_clock_value(elem.get('dur', '1s'))
+        if not duration or duration <= 0:
+            duration = 1.0
+        begin = self._parse_clock_value(elem.get('begin', '0s')) or 0.0
+
+        repeat_count = 1.0
+        repeat_str = (elem.get('repeatCount') or '').strip()
+        repeat_dur_str = (elem.get('repeatDur') or '').strip()
+        if repeat_str == 'indefinite' or repeat_dur_str == 'indefinite':
+            repeat_count = None
+        elif repeat_str:
+            try:
+                repeat_count = max(float(repeat_str), 0.0)
+            except ValueError:
+                pass
+        elif repeat_dur_str:
+            repeat_dur = self._parse_clock_value(repeat_dur_str)
+            if repeat_dur:
+                repeat_count = repeat_dur / duration
+
+        freeze = elem.get('fill') == 'freeze'
+        return begin, duration, repeat_count, freeze
+
     def get_animation_duration(self):
         """Extract animation duration from SVG"""
         root = self.tree.getroot()
@@ -42,75 +266,88 @@ class SVGProcessor:
         # Look for animate/animateTransform tags with dur
         durations = []
         for elem in root.xpath(".//*[@dur]"):
-            dur_str = elem.get('dur')
-            if dur_str.endswith('s'):
-                durations.append(float(dur_str[:-1]))
-            elif dur_str.endswith('ms'):
-                durations.append(float(dur_str[:-2]) / 1000)
+            duration = self._parse_clock_value(elem.get('dur'))
+            if duration:
+                durations.append(duration)
 
         # If no animations found, return default duration
         return max(durations) if durations else 3.0
 
-    def _parse_value(self, value_str):
-        """Parse animation value string into numeric or tuple values"""
-        if not value_str or value_str.isspace():
+    def _loop_frames(self, fps, frame_count, sample_fps=None):
+        """
+        Work out which frames need rendering when animations are periodic.
+
+        Returns (lead_in, period) in frames: every frame from lead_in onward
+        repeats with the combined period (LCM of all looping durations, and
+        of the hold pattern when sampling below fps).
+        Returns None when reuse would not save any rendering.
+        """
+        settle_time = 0.0
+        period = 1
+        hold_cycle = 1
+        if self._is_subsampled(fps, sample_fps):
+            # Samples line up with output frames again every hold_cycle frames
+            hold_cycle = Fraction(fps / sample_fps).limit_denominator(1000).numerator
+            period = hold_cycle
+        for track in self.tracks:
+            if track.repeat_count is None:
+                # Looping animations are periodic once they have begun
+                settle_time = max(settle_time, track.begin)
+                frames_per_loop = Fraction(track.duration * fps).limit_denominator(1000)
+                period = math.lcm(period, frames_per_loop.numerator)
+            else:
+                # Finite animations are static once they have ended
+                settle_time = max(settle_time, track.begin + track.duration * track.repeat_count)
+
+            if period > self.MAX_LOOP_SECONDS * fps:
+                return None
+
+        lead_in = max(0, math.ceil(settle_time * fps - 1e-9))
+        if hold_cycle > 1 and settle_time > 0:
+            # A held sample may still show the animation before it settled
+            lead_in += hold_cycle
+        if lead_in + period >= frame_count:
+            return None
+        return lead_in, period
+
+    def _parse_keyframes(self, raw_values):
+        """Parse animation values into an (n, k) float array, or None if non-numeric"""
+        rows = []
+        for raw in raw_values:
+            if not _NUMERIC_LIST_RE.fullmatch(raw):
+                return None
+            rows.append([float(v) for v in _NUMBER_RE.findall(raw)])
+        if len({len(row) for row in rows}) != 1:
             return None
+        return np.array(rows, dtype=np.float64)
 
-        # Try coordinate pair (x,y)
-        parts = value_str.strip().split()
-        if len(parts) == 2:
-            # Attempt to parse both as floats
+    def _parse_key_times(self, elem, count):
+        """Parse keyTimes, falling back to evenly spaced keyframes"""
+        key_times_str = elem.get('keyTimes')
+        if key_times_str:
             try:
-                x = float(parts[0])
-                y = float(parts[1])
-                return (x, y)
+                key_times = np.array([float(v) for v in key_times_str.split(';') if v.strip()])
+                if (len(key_times) == count and key_times[0] == 0.0 and key_times[-1] == 1.0
+                        and np.all(np.diff(key_times) >= 0)):
+                    return key_times
             except ValueError:
                 pass
+            logger.debug(f"Ignoring invalid keyTimes '{key_times_str}'")
+        return np.linspace(0.0, 1.0, count)
 
-        # If not a pair, try single float
-        try:
-            return float(value_str.strip())
-        except ValueError:
-            # Could not parse as float, return None
-            return None
-
-    def _interpolate_values(self, start_vals, end_vals, factor):
-        """Interpolate between two sets of values"""
-        if isinstance(start_vals, tuple) and isinstance(end_vals, tuple):
-            # Interpolate coordinate pairs
-            sx, sy = start_vals
-            ex, ey = end_vals
-            return (sx + (ex - sx)*factor, sy + (ey - sy)*factor)
-        elif isinstance(start_vals, (int, float)) and isinstance(end_vals, (int, float)):
-            # Simple numeric interpolation
-            return start_vals + (end_vals - start_vals) * factor
-        else:
-            # Unsupported type combination
-            return start_vals
-
-    def _modify_animation_time(self, time):
-        """Modify SVG to show animation at specific time"""
-        root = self.tree.getroot()
-
-        # Update all animated elements
-        # We look for elements with 'attributeName' and animation parameters
-        # Handle both animate and animateTransform
-        for elem in root.xpath(".//*[@attributeName]"):
+    def _compile_tracks(self):
+        """Compile every animate/animateTransform element into an AnimationTrack"""
+        tracks = []
+        for elem in self.tree.getroot().xpath(".//*[@attributeName]"):
             attr_name = elem.get('attributeName')
-            anim_type = elem.tag.split('}')[-1]  # animate or animateTransform
+            target = elem.getparent()
+            if target is None:
+                continue
+
             values_str = elem.get('values')
             from_val = elem.get('from')
             to_val = elem.get('to')
 
-            # Determine duration
-            dur_str = elem.get('dur', '1s')
-            if dur_str.endswith('s'):
-                duration = float(dur_str[:-1])
-            elif dur_str.endswith('ms'):
-                duration = float(dur_str[:-2]) / 1000
-            else:
-                duration = 1.0
-
             # Collect values
             raw_values = []
             if values_str:
@@ -122,107 +359,237 @@ class SVGProcessor:
                 # Not enough values to interpolate
                 continue
 
-            # Normalize time
-            normalized_time = (time % duration) / duration
-            num_segments = len(raw_values) - 1
-            segment_time = normalized_time * num_segments
-            segment_index = int(segment_time)
-            if segment_index >= num_segments:
-                segment_index = num_segments - 1
-            factor = segment_time - segment_index
+            keyframes = self._parse_keyframes(raw_values)
+            if keyframes is None:
+                # Colors and other non-numeric values are left to their static value
+                logger.debug(f"Skipping non-numeric animation of {attr_name}: {values_str}")
+                continue
 
-            try:
-                start_value = self._parse_value(raw_values[segment_index])
-                end_value = self._parse_value(raw_values[segment_index + 1])
-                if start_value is None or end_value is None:
-                    continue
-                current_value = self._interpolate_values(start_value, end_value, factor)
-
-                parent = elem.getparent()
-                if parent is None:
-                    continue
-
-                if anim_type == 'animateTransform':
-                    # Handle transform animations specifically
-                    transform_type = elem.get('type', '')
-                    # Based on transform_type, reconstruct transform string
-                    if transform_type == 'translate' and isinstance(current_value, tuple):
-                        # current_value is (x,y)
-                        parent.set(attr_name, f"translate({current_value[0]},{current_value[1]})")
-                    elif transform_type == 'scale' and isinstance(current_value, tuple):
-                        # current_value is (sx,sy)
-                        parent.set(attr_name, f"scale({current_value[0]},{current_value[1]})")
-                    elif transform_type == 'rotate':
-                        # Rotate might need additional parameters if original had them
-                        # If raw_values had rotate syntax, we must replicate it.
-                        # For simplicity, assume just angle interpolation:
-                        if isinstance(current_value, (int,float)):
-                            # If original rotate had center points,
-                            # we must detect them from the first raw value:
-                            parts = raw_values[segment_index].split()
-                            # Expect something like "angle cx cy"
-                            # If not provided, default (0,0)
-                            if len(parts) == 3:
-                                cx = parts[1]
-                                cy = parts[2]
-                                parent.set(attr_name, f"rotate({current_value} {cx} {cy})")
-                            else:
-                                parent.set(attr_name, f"rotate({current_value})")
-                    else:
-                        # Unsupported transform type or no complex handling needed
-                        # If it's a single numeric value and it's translate-like, handle accordingly
-                        # If we can't determine how to format it, skip
-                        pass
-                else:
-                    # Normal attribute animation (e.g., color or numeric)
-                    # Just set the attribute to the numeric or tuple value
-                    # If tuple, join by space
-                    if isinstance(current_value, tuple):
-                        parent.set(attr_name, f"{current_value[0]} {current_value[1]}")
-                    else:
-                        parent.set(attr_name, str(current_value))
-
-            except Exception as e:
-                logger.warning(f"Error interpolating animation values for {attr_name}: {e}")
+            anim_type = elem.tag.split('}')[-1]  # animate or animateTransform
+            transform_type = elem.get('type', 'translate') if anim_type == 'animateTransform' else None
+            if transform_type is not None and transform_type not in _TRANSFORM_FORMATS:
+                logger.debug(f"Skipping unsupported transform type: {transform_type}")
                 continue
 
-    async def generate_frames(self, duration, fps):
-        """Generate frames for the animation"""
-        frames = []
-        frame_count = int(duration * fps)
+            begin, duration, repeat_count, freeze = self._animation_timing(elem)
+            tracks.append(AnimationTrack(
+                target=target,
+                attribute=attr_name,
+                transform_type=transform_type,
+                key_times=self._parse_key_times(elem, len(keyframes)),
+                keyframes=keyframes,
+                begin=begin,
+                duration=duration,
+                repeat_count=repeat_count,
+                freeze=freeze
+            ))
+        return tracks
+
+    def _evaluate_tracks(self, times):
+        """Evaluate every track at the given times; returns one (len(times), k) array per track"""
+        times = np.asarray(times, dtype=np.float64)
+        return [track.evaluate(times) for track in self.tracks]
+
+    def _apply_track_values(self, track_values, row):
+        """Set animated attributes to the precomputed values of one frame"""
+        for track, values in zip(self.tracks, track_values):
+            track.target.set(track.attribute, track.format_value(values[row]))
 
-        logger.info(f"Generating {frame_count} frames at {fps} FPS")
+    def _modify_animation_time(self, time):
+        """Modify SVG to show animation at specific time"""
+        self._apply_track_values(self._evaluate_tracks([time]), 0)
+
+    def _output_size(self, size):
+        """Normalize a size argument (None, an int or a (width, height) pair) to a pair"""
+        if size is None:
+            return self.OUTPUT_SIZE, self.OUTPUT_SIZE
+        if isinstance(size, int):
+            size = (size, size)
+        width, height = size
+        if width < 1 or height < 1:
+            raise ValueError(f"Invalid output size: {size}")
+        return int(width), int(height)
+
+    def _rasterize(self, svg_bytes, frame_format, size=None):
+        """Rasterize SVG bytes to PNG bytes or a premultiplied RGBA array of the given size"""
+        size = self._output_size(size)
+        if frame_format == "png":
+            return self.rasterizer.render_png(svg_bytes, size, self.OUTPUT_SIZE)
+        return self.rasterizer.render(svg_bytes, size, self.OUTPUT_SIZE)
+
+    def _rasterize_layer(self, svg_bytes, size):
+        """Rasterize a layer; returns the RGBA array and the root user space to pixel matrix"""
+        return self.rasterizer.render_layer(svg_bytes, self._output_size(size), self.OUTPUT_SIZE)
+
+    def _layered_renderer(self, track_values, size, plan=None):
+        """
+        The layered renderer for array frames of the given size, or None to
+        rasterize in full. The renderer is only valid for the frames it was
+        built from (they pick each affine layer's reference raster and show
+        whether it ever touches the canvas edge), so it is cached per plan:
+        the (duration, fps, sample_fps) that track_values were evaluated for.
+        """
+        size = self._output_size(size)
+        key = (size, plan)
+        if key not in self._layered_renderers:
+            renderer = None
+            if self.layered and self.rasterizer.supports_layers:
+                renderer = LayeredRenderer.build(
+                    self.tree.getroot(),
+                    self.tracks,
+                    track_values,
+                    lambda row: self._apply_track_values(track_values, row),
+                    lambda svg_bytes: self._rasterize_layer(svg_bytes, size),
+                    size
+                )
+            self._layered_renderers[key] = renderer
+        return self._layered_renderers[key]
+
+    def _check_frame_format(self, frame_format):
+        if frame_format not in FRAME_FORMATS:
+            raise ValueError(f"Unsupported frame format: {frame_format}. "
+                             f"Supported formats: {', '.join(FRAME_FORMATS)}")
+
+    @staticmethod
+    def _is_subsampled(fps, sample_fps):
+        return sample_fps is not None and 0 < sample_fps < fps
+
+    def _frame_times(self, count, fps, sample_fps=None):
+        """
+        Animation time shown by each of the first count output frames.
+
+        Below the output rate, frames hold the latest sample: frame i shows
+        the animation at floor(i * sample_fps / fps) / sample_fps.
+        """
+        frames = np.arange(count)
+        if not self._is_subsampled(fps, sample_fps):
+            return frames / fps
+        return np.floor(frames * sample_fps / fps + 1e-9) / sample_fps
+
+    def _plan_frames(self, duration, fps, sample_fps=None):
+        """Return (frame_count, lead_in, period, track_values, sources) for a render"""
+        if not self.tree:
+            raise ValueError("SVG not loaded properly")
 
-        with tempfile.TemporaryDirectory() as temp_dir:
-            for i in range(frame_count):
-                time = i / fps
-                logger.info(f"Generating frame {i+1}/{frame_count}")
+        frame_count = int(duration * fps)
+        plan = self._plan_at_rate(frame_count, fps, sample_fps)
+        if self._is_subsampled(fps, sample_fps):
+            # Holding samples breaks loops whose length is not a whole number of
+            # samples; keep the full rate when that would render more frames
+            full_rate = self._plan_at_rate(frame_count, fps)
+            if self._distinct_count(full_rate[3]) <= self._distinct_count(plan[3]):
+                logger.info(f"Sampling at {sample_fps} FPS saves no rendering here; sampling at {fps} FPS")
+                plan = full_rate
+
+        lead_in, period = plan[0], plan[1]
+        if lead_in + period < frame_count:
+            logger.info(f"Animation loops every {period} frames after {lead_in} lead-in frames; "
+                        f"rendering {lead_in + period} of {frame_count} frames")
+        return (frame_count,) + plan
+
+    def _plan_at_rate(self, frame_count, fps, sample_fps=None):
+        """(lead_in, period, track_values, sources) for frame_count frames sampled at sample_fps"""
+        loop = self._loop_frames(fps, frame_count, sample_fps)
+        if loop:
+            lead_in, period = loop
+        else:
+            lead_in, period = frame_count, 1
+
+        # Evaluate every animation track for all frames that need rendering in one pass
+        render_count = min(lead_in + period, frame_count)
+        track_values = self._evaluate_tracks(self._frame_times(render_count, fps, sample_fps))
+        sources = self._state_sources(track_values, render_count)
+        return lead_in, period, track_values, sources
+
+    @staticmethod
+    def _distinct_count(sources):
+        return int(np.count_nonzero(sources == np.arange(len(sources))))
+
+    def _state_sources(self, track_values, render_count):
+        """For each frame to render, the first frame with an identical animation state"""
+        if not self.tracks or render_count == 0:
+            return np.zeros(render_count, dtype=np.int64)
+        states = np.hstack(track_values)
+        _, first, inverse = np.unique(states, axis=0, return_index=True, return_inverse=True)
+        return first[inverse.reshape(-1)]
+
+    def _render_frame(self, track_values, index, frame_format, size=None, plan=None):
+        """
+        Rasterize the frame whose precomputed track values are at the given
+        row; plan identifies track_values (see _layered_renderer)
+        """
+        try:
+            renderer = None
+            if frame_format == "array":
+                renderer = self._layered_renderer(track_values, size, plan)
+
+            # Modify SVG for current time
+            self._apply_track_values(track_values, index)
+            if renderer is not None:
+                return renderer.render()
+
+            # Convert SVG to PNG bytes or raw pixels
+            svg_bytes = etree.tostring(self.tree.getroot(), encoding='utf-8', method='xml')
+            return self._rasterize(svg_bytes, frame_format, size)
+        except Exception as e:
+            logger.error(f"Failed to generate frame {index+1}: {e}")
+            logger.exception("Detailed error:")
+            raise
 
-                try:
-                    if not self.tree:
-                        raise ValueError("SVG not loaded properly")
+    async def generate_frames(self, duration, fps, frame_format="png", size=None, sample_fps=None):
+        """
+        Generate frames for the animation.
+
+        Periodic animations are only rendered for their lead-in and one loop
+        period, and frames whose animation state repeats an earlier frame
+        (for example after a fill="freeze" fade has ended) are rendered once;
+        the returned sequence replays those frames where they recur.
+
+        frame_format selects PNG bytes ("png") or premultiplied RGBA uint8
+        arrays ("array") which can be composited without decoding. size is the
+        output size in pixels, an int or (width, height), default OUTPUT_SIZE;
+        rasterizing at the on-screen size avoids drawing pixels that would
+        only be thrown away by a later downscale. sample_fps below fps samples
+        the animation at that rate (e.g. 12 or 15 for subtle idle loops) and
+        holds each sample until the next, so fewer distinct frames are
+        rendered while the sequence keeps its fps length.
+        """
+        self._check_frame_format(frame_format)
+        size = self._output_size(size)
+        frame_count, lead_in, period, track_values, sources = self._plan_frames(duration, fps, sample_fps)
+        render_count = min(lead_in + period, frame_count)
+        unique_count = self._distinct_count(sources)
+
+        logger.info(f"Generating {frame_count} frames at {fps} FPS ({size[0]}x{size[1]})")
+
+        frames = [None] * render_count
+        for i in range(render_count):
+            if sources[i] != i:
+                continue
+            logger.info(f"Generating frame {i+1}/{render_count}")
+            frames[i] = self._render_frame(track_values, i, frame_format, size, (duration, fps, sample_fps))
 
-                    # Modify SVG for current time
-                    self._modify_animation_time(time)
+        logger.info(f"Frame generation complete ({unique_count} distinct frames)")
 
-                    # Convert SVG to PNG bytes
-                    svg_bytes = etree.tostring(self.tree.getroot(), encoding='utf-8', method='xml')
-                    png_data = cairosvg.svg2png(
-                        bytestring=svg_bytes,
-                        output_width=1024,
-                        output_height=1024,
-                        background_color="rgba(0,0,0,0)",
-                        parent_width=1024,
-                        parent_height=1024
-                    )
+        if unique_count < frame_count:
+            return LoopedFrames(frames, lead_in, period, frame_count, sources)
+        return frames
 
-                    frames.append(png_data)
+    def lazy_frames(self, duration, fps, max_cached=None, frame_format="array", size=None, sample_fps=None):
+        """
+        Return a sequence of frames that are rasterized on first access,
+        keeping at most max_cached rendered frames in memory (None keeps all).
+        sample_fps is as for generate_frames.
+        """
+        self._check_frame_format(frame_format)
+        size = self._output_size(size)
+        frame_count, lead_in, period, track_values, sources = self._plan_frames(duration, fps, sample_fps)
+        logger.info(f"Rendering {frame_count} frames at {fps} FPS on demand "
+                    f"(caching up to {max_cached if max_cached is not None else 'all'})")
 
-                except Exception as e:
-                    logger.error(f"Failed to generate frame {i+1}: {e}")
-                    logger.exception("Detailed error:")
-                    raise
+        plan = (duration, fps, sample_fps)
 
-            logger.info("Frame generation complete")
+        def render(index):
+            return self._render_frame(track_values, index, frame_format, size, plan)
 
-        return frames
+        return LazyFrames(render, lead_in, period, frame_count, max_cached, sources)
@@ -0,0 +1,231 @@
+"""
+LayeredRenderer frames checked against whole-frame rasterization.
+
+The rasterizer is a small stand-in backend that paints solid <rect>s
+(through <g>, <use>, transforms and opacity, 4x4 supersampled) and reports
+the viewBox to pixel matrix, so these tests run without cairo or any
+other SVG renderer installed.
+"""
+import asyncio
+
+import numpy as np
+import pytest
+from lxml import etree
+
+from rasterizers import Rasterizer
+from svg_layers import parse_transform
+from svg_processor import SVGProcessor
+
+SIZE = (100, 100)
+# Five frames over one 1s animation period
+TIMES = np.linspace(0.0, 0.8, 5)
+_XLINK_HREF = '{http://www.w3.org/1999/xlink}href'
+_SKIPPED_TAGS = {'defs', 'linearGradient', 'radialGradient', 'animate', 'animateTransform'}
+
+
+class ViewportRasterizer(Rasterizer):
+    """Paints solid <rect>s and reports the root user space to pixel matrix"""
+
+    name = "test-viewport"
+    supports_layers = True
+    SAMPLES = 4
+
+    def render(self, svg_bytes, size, parent_size):
+        return self.render_layer(svg_bytes, size, parent_size)[0]
+
+    def render_layer(self, svg_bytes, size, parent_size):
+        root = etree.fromstring(svg_bytes)
+        width, height = size
+        _, _, view_width, view_height = (float(v) for v in root.get('viewBox').split())
+        viewport = np.diag([width / view_width, height / view_height, 1.0])
+        ids = {e.get('id'): e for e in root.iter(tag=etree.Element) if e.get('id')}
+        samples = (np.arange(width * self.SAMPLES) + 0.5) / self.SAMPLES
+        rows = (np.arange(height * self.SAMPLES) + 0.5) / self.SAMPLES
+        self._points = np.meshgrid(samples, rows)
+        frame = np.zeros((height, width, 4))
+        for child in root:
+            self._paint(child, viewport, ids, frame)
+        return np.rint(frame * 255).astype(np.uint8), viewport
+
+    def _paint(self, elem, matrix, ids, frame):
+        if not isinstance(elem.tag, str) or etree.QName(elem).localname in _SKIPPED_TAGS:
+            return
+        tag = etree.QName(elem).localname
+        matrix = matrix @ parse_transform(elem.get('transform'))
+        opacity = float(elem.get('opacity', '1'))
+        if tag == 'rect':
+            self._paint_rect(elem, matrix, opacity, frame)
+            return
+        if tag == 'use':
+            href = elem.get('href') or elem.get(_XLINK_HREF)
+            offset = parse_transform(f"translate({elem.get('x', '0')},{elem.get('y', '0')})")
+            matrix, children = matrix @ offset, [ids[href[1:]]]
+        else:
+            children = list(elem)
+        group = np.zeros_like(frame)
+        for child in children:
+            self._paint(child, matrix, ids, group)
+        _over(frame, group * opacity)
+
+    def _paint_rect(self, elem, matrix, opacity, frame):
+        x, y = float(elem.get('x', '0')), float(elem.get('y', '0'))
+        width, height = float(elem.get('width')), float(elem.get('height'))
+        fill = elem.get('fill', '#000000')
+        color = [int(fill[i:i + 2], 16) / 255 for i in (1, 3, 5)] if fill.startswith('#') else [0.5] * 3
+        inverse = np.linalg.inv(matrix)
+        px, py = self._points
+        u = inverse[0, 0] * px + inverse[0, 1] * py + inverse[0, 2]
+        v = inverse[1, 0] * px + inverse[1, 1] * py + inverse[1, 2]
+        inside = (u >= x) & (u < x + width) & (v >= y) & (v < y + height)
+        rows, cols = frame.shape[:2]
+        coverage = inside.reshape(rows, self.SAMPLES, cols, self.SAMPLES).mean(axis=(1, 3)) * opacity
+        _over(frame, coverage[..., None] * np.array(color + [1.0]))
+
+
+def _over(frame, src):
+    frame *= 1 - src[..., 3:]
+    frame += src
+
+
+def _svg(body):
+    return ('<svg xmlns="http://www.w3.org/2000/svg" xmlns:xlink="http://www.w3.org/1999/xlink" '
+            f'viewBox="0 0 100 100">{body}</svg>')
+
+
+BACKGROUND = '<rect x="0" y="0" width="100" height="100" fill="#203040"/>'
+
+
+def render_both(svg):
+    """The processor's layered renderer, and (layered, whole-frame) pairs for TIMES"""
+    processor = SVGProcessor(svg_string=svg, rasterizer=ViewportRasterizer())
+    track_values = processor._evaluate_tracks(TIMES)
+    renderer = processor._layered_renderer(track_values, SIZE)
+    frames = []
+    for row in range(len(TIMES)):
+        processor._apply_track_values(track_values, row)
+        full = processor._rasterize(etree.tostring(processor.tree.getroot()), "array", SIZE)
+        frames.append((renderer.render() if renderer is not None else None, full))
+    return renderer, frames
+
+
+def assert_close(layered, full):
+    """Resampled blits differ from direct rasterization only along anti-aliased edges"""
+    diff = np.abs(layered.astype(np.int16) - full.astype(np.int16))
+    assert diff.mean() < 1.0
+    assert abs(int(layered[..., 3].sum()) - int(full[..., 3].sum())) < 0.01 * full[..., 3].size * 255
+
+
+def layer_kinds(renderer):
+    return [layer.kind for layer in renderer.layers]
+
+
+def test_translate_group_matches_full_render():
+    renderer, frames = render_both(_svg(
+        BACKGROUND +
+        '<g><animateTransform attributeName="transform" type="translate" values="0 0;50 25" dur="1s" '
+        'repeatCount="indefinite"/><rect x="10" y="20" width="20" height="30" fill="#e0a020"/></g>'
+        '<rect x="60" y="60" width="20" height="20" fill="#40c060"/>'
+    ))
+    assert layer_kinds(renderer) == ["static", "affine", "static"]
+    for layered, full in frames:
+        # Whole-pixel moves are plain copies, so frames match exactly
+        np.testing.assert_array_equal(layered, full)
+
+
+@pytest.mark.parametrize("animation", [
+    '<animateTransform attributeName="transform" type="rotate" values="0 50 50;90 50 50" dur="1s" '
+    'repeatCount="indefinite"/>',
+    '<animateTransform attributeName="transform" type="scale" values="1;0.5" dur="1s" '
+    'repeatCount="indefinite"/>',
+])
+def test_rotate_and_scale_groups_match_full_render(animation):
+    renderer, frames = render_both(_svg(
+        BACKGROUND +
+        f'<g transform="translate(2,3)"><g>{animation}'
+        '<rect x="30" y="35" width="40" height="25" fill="#e0a020"/></g></g>'
+    ))
+    assert "affine" in layer_kinds(renderer)
+    for layered, full in frames:
+        assert_close(layered, full)
+
+
+@pytest.mark.parametrize("body", [
+    # Animation on the <use> itself
+    '<defs><g id="shape"><rect x="0" y="0" width="20" height="20" fill="#e0a020"/></g></defs>'
+    '<use xlink:href="#shape" x="10" y="10"><animateTransform attributeName="transform" type="translate" '
+    'values="0 0;40 40" dur="1s" repeatCount="indefinite"/></use>',
+    # Animated content drawn through <defs>
+    '<defs><rect id="shape" x="0" y="0" width="20" height="20" fill="#e0a020">'
+    '<animateTransform attributeName="transform" type="translate" values="0 0;40 20" dur="1s" '
+    'repeatCount="indefinite"/></rect></defs>'
+    '<use href="#shape" x="10" y="30"/><use href="#shape" x="30" y="5"/>',
+])
+def test_use_expansion_matches_full_render(body):
+    renderer, frames = render_both(_svg(BACKGROUND + body))
+    assert "affine" in layer_kinds(renderer)
+    for layered, full in frames:
+        np.testing.assert_array_equal(layered, full)
+
+
+def test_opacity_ancestor_falls_back_to_full_render():
+    renderer, _ = render_both(_svg(
+        BACKGROUND +
+        '<g opacity="0.5"><g><animateTransform attributeName="transform" type="translate" '
+        'values="0 0;40 20" dur="1s" repeatCount="indefinite"/>'
+        '<rect x="10" y="10" width="20" height="20" fill="#e0a020"/></g></g>'
+    ))
+    assert renderer is None
+
+
+def test_animated_gradient_falls_back_to_full_render():
+    renderer, _ = render_both(_svg(
+        '<defs><linearGradient id="fade"><stop offset="0" stop-color="#ff0000">'
+        '<animate attributeName="offset" values="0;1" dur="1s" repeatCount="indefinite"/></stop>'
+        '<stop offset="1" stop-color="#0000ff"/></linearGradient></defs>' +
+        BACKGROUND +
+        '<g><animateTransform attributeName="transform" type="translate" values="0 0;40 20" dur="1s" '
+        'repeatCount="indefinite"/><rect x="10" y="10" width="20" height="20" fill="url(#fade)"/></g>'
+    ))
+    assert renderer is None
+
+
+def test_edge_touching_layer_is_rerasterized():
+    renderer, frames = render_both(_svg(
+        BACKGROUND +
+        # Clipped by the canvas edge: can't be drawn from one raster
+        '<g><animateTransform attributeName="transform" type="translate" values="0 0;30 0" dur="1s" '
+        'repeatCount="indefinite"/><rect x="-10" y="40" width="30" height="20" fill="#c04040"/></g>'
+        '<g><animateTransform attributeName="transform" type="translate" values="0 0;0 30" dur="1s" '
+        'repeatCount="indefinite"/><rect x="60" y="10" width="20" height="20" fill="#e0a020"/></g>'
+    ))
+    assert layer_kinds(renderer) == ["static", "dynamic", "affine"]
+    for layered, full in frames:
+        np.testing.assert_array_equal(layered, full)
+
+
+def test_only_edge_touching_layers_fall_back_to_full_render():
+    renderer, _ = render_both(_svg(
+        BACKGROUND +
+        '<g><animateTransform attributeName="transform" type="translate" values="0 0;30 0" dur="1s" '
+        'repeatCount="indefinite"/><rect x="-10" y="40" width="30" height="20" fill="#c04040"/></g>'
+    ))
+    assert renderer is None
+
+
+def test_layered_renderer_is_rebuilt_for_a_longer_plan():
+    svg = _svg(
+        BACKGROUND +
+        # Grows past the canvas edge only after the first second
+        '<g transform="translate(30,60)"><g><animateTransform attributeName="transform" type="scale" '
+        'values="1;6" dur="4s" repeatCount="indefinite"/>'
+        '<rect x="-10" y="-10" width="20" height="20" fill="#c04040"/></g></g>'
+        '<g><animateTransform attributeName="transform" type="translate" values="0 0;0 20" dur="4s" '
+        'repeatCount="indefinite"/><rect x="60" y="10" width="20" height="20" fill="#e0a020"/></g>'
+    )
+    processor = SVGProcessor(svg_string=svg, rasterizer=ViewportRasterizer())
+    asyncio.run(processor.generate_frames(1, 5, frame_format="array", size=SIZE))
+    layered = asyncio.run(processor.generate_frames(4, 5, frame_format="array", size=SIZE))
+    full = asyncio.run(SVGProcessor(svg_string=svg, rasterizer=ViewportRasterizer(), layered=False)
+                       .generate_frames(4, 5, frame_format="array", size=SIZE))
+    for layered_frame, full_frame in zip(layered, full):
+        np.testing.assert_array_equal(layered_frame, full_frame)
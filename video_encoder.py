@@ -1,93 +1,437 @@
 #video_encoder.py
 
-from io import BytesIO
+from collections import deque
+from dataclasses import dataclass
 from pathlib import Path
+from typing import List, Optional, Tuple
 from PIL import Image
+import queue
+import shutil
 import tempfile
 import subprocess
+import threading
 import numpy as np
 import logging
 
+from ffmpeg_runner import FFmpegRunner
+
 logger = logging.getLogger(__name__)
 
+@dataclass(frozen=True)
+class OutputAspect:
+    """One output variant of an encode: a centred crop to width:height ratio, saved with a filename suffix"""
+    suffix: str
+    ratio: Tuple[int, int]
+
+    def path(self, output_path) -> Path:
+        output_path = Path(output_path)
+        return output_path.with_name(f"{output_path.stem}{self.suffix}{output_path.suffix}")
+
+    def crop(self, width: int, height: int) -> Tuple[int, int, int, int]:
+        """(width, height, x, y) of the centred crop, rounded down to even sizes"""
+        ratio_w, ratio_h = self.ratio
+        crop_w, crop_h = width, height
+        if width * ratio_h > height * ratio_w:
+            crop_w = height * ratio_w // ratio_h
+        else:
+            crop_h = width * ratio_h // ratio_w
+        crop_w, crop_h = (crop_w // 2) * 2, (crop_h // 2) * 2
+        return crop_w, crop_h, (width - crop_w) // 2, (height - crop_h) // 2
+
+
+# Square video plus 9:16 and 16:9 crops (final_video.mp4, _vertical, _horizontal)
+DEFAULT_ASPECTS = (
+    OutputAspect("", (1, 1)),
+    OutputAspect("_vertical", (9, 16)),
+    OutputAspect("_horizontal", (16, 9)),
+)
+
+
+@dataclass(frozen=True)
+class EncodingProfile:
+    """
+    Named speed/quality trade-off for a whole render: the frame rate and
+    square frame size the scene is rendered at, and the x264 settings.
+    """
+    name: str
+    fps: int
+    size: int
+    preset: str
+    crf: int
+    x264_options: Tuple[Tuple[str, str], ...] = ()
+
+    def encoder_options(self) -> List[str]:
+        options = ['-preset', self.preset, '-crf', str(self.crf)]
+        for key, value in self.x264_options:
+            options.extend([f'-{key}', value])
+        return options
+
+
+ENCODING_PROFILES = {
+    # Quick look at timing and layout
+    'draft': EncodingProfile('draft', fps=12, size=384, preset='ultrafast', crf=28),
+    'preview': EncodingProfile('preview', fps=30, size=512, preset='veryfast', crf=23, x264_options=(
+        ('tune', 'animation'),
+    )),
+    'final': EncodingProfile('final', fps=30, size=1024, preset='medium', crf=18, x264_options=(
+        ('tune', 'animation'),
+        ('profile:v', 'high'),
+        ('level', '4.1'),
+    )),
+}
+DEFAULT_PROFILE = 'final'
+
+
+def get_profile(name: Optional[str] = None) -> EncodingProfile:
+    """The named encoding profile (default DEFAULT_PROFILE)"""
+    name = name or DEFAULT_PROFILE
+    if name not in ENCODING_PROFILES:
+        raise ValueError(f"Unknown encoding profile: {name}. Available: {', '.join(ENCODING_PROFILES)}")
+    return ENCODING_PROFILES[name]
+
+
+class VideoStream:
+    """
+    Streams raw RGB frames into a running ffmpeg process.
+
+    ffmpeg is started when the stream is entered and reads rawvideo from
+    stdin. Frames are handed to a writer thread through a bounded queue, so
+    write() blocks once max_pending frames are waiting (backpressure) while
+    compositing of the next frame overlaps with encoding.
+    """
+
+    def __init__(self, encoder, width, height, max_pending=8):
+        self.encoder = encoder
+        self.width = width
+        self.height = height
+        self.frame_count = 0
+        self._queue = queue.Queue(maxsize=max(1, max_pending))
+        self._process = None
+        self._writer = None
+        self._stderr_reader = None
+        self._stderr_tail = deque(maxlen=200)
+        self._write_error = None
+        self._last_frame = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+        return False
+
+    def start(self):
+        input_args = [
+            '-f', 'rawvideo',
+            '-pix_fmt', 'rgb24',
+            '-s', f'{self.width}x{self.height}',
+            '-framerate', str(self.encoder.fps),
+            '-i', '-',
+        ]
+        ffmpeg_cmd = self.encoder.build_command(input_args, self.width, self.height)
+        logger.info(f"Starting streaming encode: {' '.join(ffmpeg_cmd)}")
+        self._process = subprocess.Popen(
+            ffmpeg_cmd,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE
+        )
+        self._writer = threading.Thread(target=self._write_loop, daemon=True)
+        self._writer.start()
+        self._stderr_reader = threading.Thread(target=self._read_stderr, daemon=True)
+        self._stderr_reader.start()
+
+    def write(self, frame):
+        """Queue one (h, w, 3) or (h, w, 4) uint8 frame; blocks while the queue is full"""
+        if self._write_error is not None:
+            raise RuntimeError(f"FFmpeg stopped accepting frames: {self._write_error}")
+        if frame.shape[:2] != (self.height, self.width):
+            raise ValueError(f"Frame has shape {frame.shape}, expected {(self.height, self.width)}")
+        # Copy into bytes so the caller is free to reuse its frame buffer
+        self._last_frame = np.ascontiguousarray(frame[..., :3], dtype=np.uint8).tobytes()
+        self._enqueue(self._last_frame)
+
+    def hold(self):
+        """Repeat the last written frame; its bytes are queued again without copying"""
+        if self._last_frame is None:
+            raise ValueError("No frame to hold")
+        if self._write_error is not None:
+            raise RuntimeError(f"FFmpeg stopped accepting frames: {self._write_error}")
+        self._enqueue(self._last_frame)
+
+    def _enqueue(self, data: bytes):
+        self._queue.put(data)
+        self.frame_count += 1
+        if self.frame_count % 30 == 0:
+            logger.info(f"Streamed frame {self.frame_count}")
+
+    def close(self):
+        """Flush pending frames, wait for ffmpeg and validate the output"""
+        try:
+            self._finish_process()
+            if self.frame_count == 0:
+                raise ValueError("No frames to encode")
+            if self._write_error is not None:
+                raise RuntimeError(f"Failed to stream frames to FFmpeg: {self._write_error}")
+            if self._process.returncode != 0:
+                logger.error("\nFFmpeg Error Output:")
+                logger.error("=" * 40)
+                logger.error("".join(self._stderr_tail))
+                logger.error("=" * 40)
+                raise RuntimeError(f"FFmpeg encoding failed with return code {self._process.returncode}")
+            self.encoder.check_output()
+            return self.encoder.output_path
+        except Exception as e:
+            logger.error(f"Video encoding failed: {str(e)}")
+            self.encoder.remove_outputs()
+            raise
+
+    def abort(self):
+        """Stop ffmpeg without finishing the file and remove partial output"""
+        if self._process is not None and self._process.poll() is None:
+            self._process.kill()
+        try:
+            self._finish_process()
+        except Exception as e:
+            logger.warning(f"Error while aborting encode: {e}")
+        self.encoder.remove_outputs()
+
+    def _finish_process(self):
+        self._queue.put(None)
+        self._writer.join()
+        try:
+            self._process.stdin.close()
+        except (BrokenPipeError, OSError):
+            pass
+        self._process.wait()
+        self._stderr_reader.join()
+
+    def _write_loop(self):
+        while True:
+            data = self._queue.get()
+            if data is None:
+                return
+            if self._write_error is not None:
+                # Keep draining so producers never block on a dead process
+                continue
+            try:
+                self._process.stdin.write(data)
+            except (BrokenPipeError, OSError) as e:
+                self._write_error = e
+
+    def _read_stderr(self):
+        for line in iter(self._process.stderr.readline, b''):
+            self._stderr_tail.append(line.decode('utf-8', errors='replace'))
+        self._process.stderr.close()
+
+
 class VideoEncoder:
     FORMAT_CONFIGS = {
         '.mp4': {
             'vcodec': 'libx264',
-            'preset': 'medium',
-            'crf': '18',
             'pix_fmt': 'yuv420p',
-            'movflags': '+faststart',
-            'tune': 'animation',
-            'profile:v': 'high',
-            'level': '4.1'
+            'movflags': '+faststart'
         }
     }
+    # Seconds between keyframes
+    KEYFRAME_INTERVAL = 5
 
-    def __init__(self, output_path, fps):
+    def __init__(self, output_path, fps, aspects: Optional[Tuple[OutputAspect, ...]] = None,
+                 audio_path=None, profile: Optional[EncodingProfile] = None):
+        """
+        With aspects, one encode writes every aspect variant (see
+        OutputAspect.path) from a single decode of the input through a split
+        filter graph; otherwise it writes output_path only. audio_path is
+        muxed into every output in the same ffmpeg run; the video should
+        cover the whole audio, which is not trimmed. profile supplies the
+        x264 settings (default the 'final' profile).
+        """
         self.output_path = output_path
         self.fps = fps
+        self.aspects = tuple(aspects) if aspects else None
+        self.audio_path = audio_path
+        self.profile = profile or get_profile()
         self.format = Path(output_path).suffix.lower()
 
         if self.format not in self.FORMAT_CONFIGS:
             raise ValueError(f"Unsupported output format: {self.format}. "
                              f"Supported formats: {', '.join(self.FORMAT_CONFIGS.keys())}")
 
-        self.temp_dir = tempfile.mkdtemp()
+        self.temp_dir = None
 
-    def encode_frames(self, frames):
-        try:
-            if not frames:
-                raise ValueError("No frames to encode")
+    @property
+    def output_paths(self) -> List[Path]:
+        """Every file this encoder writes"""
+        if self.aspects is None:
+            return [Path(self.output_path)]
+        return [aspect.path(self.output_path) for aspect in self.aspects]
+
+    def _output_options(self):
+        """Encoder options, repeated for every output file"""
+        options = [
+            '-vsync', 'cfr',
+            '-g', str(self.KEYFRAME_INTERVAL * self.fps),
+            '-bf', '2',
+        ]
+        for key, value in self.FORMAT_CONFIGS[self.format].items():
+            if key != 'pix_fmt':
+                options.extend([f'-{key}', str(value)])
+        return options + self.profile.encoder_options()
+
+    def _audio_input(self):
+        return ['-i', str(self.audio_path)] if self.audio_path else []
 
-            frame_paths = []
+    def _audio_options(self):
+        """Map the audio input (input 1) into an output and encode it"""
+        return ['-map', '1:a', '-c:a', 'aac'] if self.audio_path else []
 
-            temp_dir = Path(self.temp_dir)
-            temp_dir.mkdir(parents=True, exist_ok=True)
+    def build_command(self, input_args, width, height):
+        """Build the ffmpeg command line for the given input arguments and frame size"""
+        Path(self.output_path).parent.mkdir(parents=True, exist_ok=True)
+        if self.aspects is not None:
+            return self._build_split_command(input_args, width, height)
 
-            for i, frame_data in enumerate(frames, 1):
-                try:
-                    frame_path = temp_dir / f"frame_{i:06d}.png"
-                    with open(frame_path, 'wb') as f:
-                        f.write(frame_data)
-                    frame_paths.append(frame_path)
-                    # Keep progress logs every 10 frames
-                    if i % 10 == 0:
-                        logger.info(f"Saved frame {i}/{len(frames)}")
-                except Exception as e:
-                    logger.error(f"Failed to save frame {i}: {e}")
-                    raise
+        width = (width // 2) * 2
+        height = (height // 2) * 2
+        return [
+            'ffmpeg',
+            '-y',
+            *input_args,
+            *self._audio_input(),
+            '-vf', f'scale={width}:{height},format=yuv420p',
+            *(['-map', '0:v'] if self.audio_path else []),
+            *self._audio_options(),
+            *self._output_options(),
+            str(self.output_path)
+        ]
 
-            if not frame_paths:
-                raise ValueError("No frames were saved successfully")
+    def _build_split_command(self, input_args, width, height):
+        """Decode once, split the video and crop and encode one output per aspect"""
+        count = len(self.aspects)
+        graph = [f"[0:v]split={count}" + "".join(f"[s{i}]" for i in range(count))]
+        outputs = []
+        for i, aspect in enumerate(self.aspects):
+            crop_w, crop_h, x, y = aspect.crop(width, height)
+            graph.append(f"[s{i}]crop={crop_w}:{crop_h}:{x}:{y},format=yuv420p[v{i}]")
+            outputs.extend(['-map', f'[v{i}]', *self._audio_options(), *self._output_options(),
+                            str(aspect.path(self.output_path))])
+        return ['ffmpeg', '-y', *input_args, *self._audio_input(), '-filter_complex', ";".join(graph), *outputs]
+
+    def check_output(self):
+        for output_path in self.output_paths:
+            if not output_path.exists():
+                raise RuntimeError(f"Output file was not created: {output_path}")
+
+            file_size = output_path.stat().st_size
+            if file_size == 0:
+                raise RuntimeError(f"Output file is empty: {output_path}")
+
+    def remove_outputs(self):
+        for output_path in self.output_paths:
+            output_path.unlink(missing_ok=True)
+
+    @staticmethod
+    async def concat(video_paths, output_path, list_path=None, audio_path=None,
+                     runner: Optional[FFmpegRunner] = None):
+        """
+        Join videos encoded with identical settings using the ffmpeg concat
+        demuxer, copying streams without re-encoding. audio_path is muxed in
+        as the soundtrack of the joined video. ffmpeg runs without blocking
+        the event loop, through runner when given.
+        """
+        output_path = Path(output_path)
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+        if list_path is None:
+            list_path = output_path.with_name(f"{output_path.stem}_concat_list.txt")
+            remove_list = True
+        else:
+            remove_list = False
+
+        with open(list_path, 'w') as f:
+            for v in video_paths:
+                f.write(f"file '{v}'\n")
+
+        cmd = [
+            'ffmpeg', '-y',
+            '-f', 'concat',
+            '-safe', '0',
+            '-i', str(list_path),
+        ]
+        if audio_path:
+            cmd.extend(['-i', str(audio_path), '-map', '0:v', '-map', '1:a', '-c:v', 'copy', '-c:a', 'aac'])
+        else:
+            cmd.extend(['-c', 'copy'])
+        cmd.append(str(output_path))
+        logger.info(f"Concatenating {len(video_paths)} videos into {output_path}")
+        try:
+            await (runner or FFmpegRunner()).run(cmd)
+        finally:
+            if remove_list:
+                Path(list_path).unlink(missing_ok=True)
+        return output_path
 
+    def stream(self, width, height, max_pending=8):
+        """
+        Open a streaming encode for frames of the given size.
+
+            with encoder.stream(width, height) as stream:
+                for frame in frames:
+                    stream.write(frame)
+        """
+        return VideoStream(self, width, height, max_pending=max_pending)
+
+    def _write_png_frames(self, frames, temp_dir):
+        """Write PNG-encoded frames to disk and return ffmpeg input arguments"""
+        frame_paths = []
+        for i, frame_data in enumerate(frames, 1):
             try:
-                with Image.open(frame_paths[0]) as img:
-                    width, height = img.size
-                    width = (width // 2) * 2
-                    height = (height // 2) * 2
+                frame_path = temp_dir / f"frame_{i:06d}.png"
+                with open(frame_path, 'wb') as f:
+                    f.write(frame_data)
+                frame_paths.append(frame_path)
+                # Keep progress logs every 10 frames
+                if i % 10 == 0:
+                    logger.info(f"Saved frame {i}/{len(frames)}")
             except Exception as e:
-                logger.error(f"Failed to read frame dimensions: {e}")
+                logger.error(f"Failed to save frame {i}: {e}")
                 raise
 
-            config = self.FORMAT_CONFIGS[self.format]
-            ffmpeg_cmd = [
-                'ffmpeg',
-                '-y',
-                '-framerate', str(self.fps),
-                '-i', str(temp_dir / 'frame_%06d.png'),
-                '-vf', f'scale={width}:{height},format=yuv420p',
-                '-vsync', 'cfr',
-                '-g', '150',
-                '-bf', '2',
-            ]
-
-            for key, value in config.items():
-                if key != 'pix_fmt':
-                    ffmpeg_cmd.extend([f'-{key}', str(value)])
-
-            Path(self.output_path).parent.mkdir(parents=True, exist_ok=True)
-            ffmpeg_cmd.append(str(self.output_path))
+        if not frame_paths:
+            raise ValueError("No frames were saved successfully")
+
+        try:
+            with Image.open(frame_paths[0]) as img:
+                width, height = img.size
+        except Exception as e:
+            logger.error(f"Failed to read frame dimensions: {e}")
+            raise
+
+        input_args = ['-framerate', str(self.fps), '-i', str(temp_dir / 'frame_%06d.png')]
+        return input_args, width, height
+
+    def encode_frames(self, frames):
+        """
+        Encode a list of frames. Frames may be PNG bytes or uint8 RGB/RGBA
+        arrays; arrays are piped to ffmpeg as rawvideo without touching disk.
+        """
+        if frames and isinstance(frames[0], np.ndarray):
+            height, width = frames[0].shape[:2]
+            with self.stream(width, height) as stream:
+                for frame in frames:
+                    stream.write(frame)
+            return self.output_path
+
+        try:
+            if not frames:
+                raise ValueError("No frames to encode")
+
+            self.temp_dir = tempfile.mkdtemp()
+            input_args, width, height = self._write_png_frames(frames, Path(self.temp_dir))
+            ffmpeg_cmd = self.build_command(input_args, width, height)
 
             try:
                 result = subprocess.run(
@@ -103,31 +447,17 @@ class VideoEncoder:
                 logger.error("=" * 40)
                 raise RuntimeError(f"FFmpeg encoding failed with return code {e.returncode}")
 
-            if not Path(self.output_path).exists():
-                raise RuntimeError("Output file was not created")
-
-            file_size = Path(self.output_path).stat().st_size
-            if file_size == 0:
-                raise RuntimeError("Output file is empty")
-
+            self.check_output()
             return self.output_path
 
         except Exception as e:
             logger.error(f"Video encoding failed: {str(e)}")
-            if Path(self.output_path).exists():
-                Path(self.output_path).unlink()
+            self.remove_outputs()
             raise
 
         finally:
             try:
-                if frame_paths:
-                    for frame_path in frame_paths:
-                        try:
-                            frame_path.unlink()
-                        except Exception as e:
-                            logger.warning(f"Failed to delete temporary frame {frame_path}: {e}")
-                if Path(self.temp_dir).exists():
-                    import shutil
+                if self.temp_dir and Path(self.temp_dir).exists():
                     shutil.rmtree(self.temp_dir)
             except Exception as e:
                 logger.warning(f"Error during cleanup: {e}")
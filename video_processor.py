@@ -1,7 +1,9 @@
+import asyncio
 import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-from typing import List, Dict, Optional, Tuple
-from io import BytesIO
+from typing import List, Dict, Optional, Sequence, Tuple
 from PIL import Image
 import subprocess
 import numpy as np
@@ -9,32 +11,324 @@ import cairosvg
 import math
 
 from asset_manager import AssetManager
-from svg_processor import SVGProcessor
-from video_encoder import VideoEncoder
+from blending import blend_over
+from compositor import FrameCompositor
+from ffmpeg_runner import FFmpegRunner
+from particles import ParticleSystem
+from raster_cache import RasterCache
+from render_plan import RenderPlan, SpriteTrack
+from sprite_cache import SpriteCache, SpriteStore
+from svg_processor import SVGProcessor, frame_source_index
+from video_encoder import OutputAspect, VideoEncoder, get_profile
 
 logger = logging.getLogger(__name__)
 
 class VideoProcessor:
-    def __init__(self, asset_manager: AssetManager):
+    # Size of one rasterized 1024x1024 RGBA frame
+    FRAME_BYTES = 1024 * 1024 * 4
+    # Shortest frame range worth splitting off into its own encode
+    MIN_SEGMENT_SECONDS = 1.0
+
+    def __init__(self, asset_manager: AssetManager, memory_budget_mb: Optional[float] = None,
+                 sprite_mipmaps: bool = False, compositor_threads: int = 1,
+                 raster_cache_mb: Optional[float] = RasterCache.DEFAULT_MAX_BYTES / (1024 * 1024),
+                 rasterizer: Optional[str] = None, aspects: Optional[Sequence[OutputAspect]] = None,
+                 ffmpeg_runner: Optional[FFmpegRunner] = None, profile: Optional[str] = None):
+        """
+        memory_budget_mb switches to bounded-memory rendering: SVG frames are
+        rasterized on demand and each track keeps only as many frames as fit
+        in its share of the budget. None renders every track up front.
+        sprite_mipmaps lets large sprite downscales start from a
+        half-resolution level (faster, slightly softer).
+        compositor_threads > 1 blends each frame's sprites in horizontal
+        tiles on that many threads; useful when spare cores are not already
+        busy with worker processes (e.g. a single-scene story).
+        raster_cache_mb is the disk space of the persistent sprite raster
+        cache shared by all runs (see raster_cache.RasterCache); None
+        disables it. rasterizer names the SVG rasterizer backend (see
+        rasterizers.py; default cairosvg). aspects makes every scene encode
+        also write cropped variants (see video_encoder.OutputAspect) in the
+        same ffmpeg pass; None writes only the square video. ffmpeg_runner
+        runs the ffmpeg steps outside the streaming encode (segment concats)
+        and bounds how many run at once. profile names the encoding profile
+        (see video_encoder.ENCODING_PROFILES; default 'final'); its frame
+        rate and frame size apply to the whole render, rasterization
+        included, not just to x264.
+        """
         self.asset_manager = asset_manager
-
-    async def create_scene_video(self, scene_data: Dict, output_path: Optional[Path] = None) -> Path:
+        self.memory_budget_mb = memory_budget_mb
+        self.sprite_mipmaps = sprite_mipmaps
+        self.compositor_threads = compositor_threads
+        # Sprite track frames rendered up front, shared by every scene of the run
+        self.sprite_store = SpriteStore()
+        self.rasterizer = rasterizer
+        self.aspects = tuple(aspects) if aspects else None
+        self.ffmpeg_runner = ffmpeg_runner or FFmpegRunner()
+        self.profile = get_profile(profile)
+        self.fps = self.profile.fps
+        # Scene coordinates are laid out for OUTPUT_SIZE frames
+        self.render_scale = self.profile.size / SVGProcessor.OUTPUT_SIZE
+        self.raster_cache_mb = raster_cache_mb
+        self.raster_cache = None
+        if raster_cache_mb is not None:
+            self.raster_cache = RasterCache(Path(asset_manager.base_dir) / "raster_cache",
+                                            max_bytes=int(raster_cache_mb * 1024 * 1024))
+
+    def worker_options(self) -> Dict:
+        """Constructor options for the VideoProcessor of a render worker process"""
+        return {
+            "memory_budget_mb": self.memory_budget_mb,
+            "sprite_mipmaps": self.sprite_mipmaps,
+            "compositor_threads": self.compositor_threads,
+            "raster_cache_mb": self.raster_cache_mb,
+            "rasterizer": self.rasterizer,
+            "aspects": self.aspects,
+            "profile": self.profile.name
+        }
+
+    def _sprite_cache(self) -> SpriteCache:
+        """Scaled-sprite cache, given a quarter of the memory budget when there is one"""
+        max_bytes = SpriteCache.DEFAULT_MAX_BYTES
+        if self.memory_budget_mb is not None:
+            max_bytes = int(self.memory_budget_mb * 1024 * 1024 / 4)
+        return SpriteCache(max_bytes=max_bytes, mipmaps=self.sprite_mipmaps)
+
+    def _max_cached_frames(self, track_count: int, frame_bytes: int = FRAME_BYTES) -> Optional[int]:
+        """Frames of frame_bytes each track may keep in memory under the budget (None = unbounded)"""
+        if self.memory_budget_mb is None:
+            return None
+        # A quarter of the budget is left for the scaled-sprite cache
+        budget_bytes = self.memory_budget_mb * 1024 * 1024 * 0.75
+        return max(1, int(budget_bytes // (max(1, track_count) * frame_bytes)))
+
+    def sprite_raster_size(self, max_scale: float) -> Tuple[int, int]:
+        """Raster size for a sprite track drawn at most at max_scale of the full SVG size"""
+        width, height = SpriteCache.scaled_size(SVGProcessor.OUTPUT_SIZE, SVGProcessor.OUTPUT_SIZE,
+                                                max_scale * self.render_scale)
+        return max(1, width), max(1, height)
+
+    async def _svg_frames(self, svg_processor: SVGProcessor, duration: float, fps: int,
+                          max_cached: Optional[int], lazy: bool = False,
+                          size: Optional[Tuple[int, int]] = None, sample_fps: Optional[float] = None):
+        """Render SVG frames up front, or lazily when running under a memory budget"""
+        if max_cached is None and not lazy:
+            return await svg_processor.generate_frames(duration=duration, fps=fps, frame_format="array", size=size,
+                                                       sample_fps=sample_fps)
+        return svg_processor.lazy_frames(duration, fps, max_cached, frame_format="array", size=size,
+                                         sample_fps=sample_fps)
+
+    async def _sprite_frames(self, svg_data: str, duration: float, fps: int, max_cached: Optional[int],
+                             lazy: bool, size: Tuple[int, int], sample_fps: Optional[float] = None):
+        """
+        Frames of a sprite track. Tracks rendered up front are shared through
+        the sprite store of this process; tracks rendered lazily under a
+        memory budget stay within their scene. Tracks found in the
+        persistent raster cache are memory-mapped instead of rendered, and
+        tracks rendered up front are added to it. With the raster cache on
+        (and no budget), a partial frame range renders its missing tracks in
+        full too, so the cache gets filled; warm_sprite_tracks does that
+        before segments fan out to worker processes.
+        """
+        shared = max_cached is None and (not lazy or self.raster_cache is not None)
+        key = SpriteStore.key(svg_data, duration, fps, size, sample_fps)
+        if shared:
+            frames = self.sprite_store.get(key)
+            if frames is not None:
+                return frames
+
+        cache_key = None
+        if self.raster_cache is not None:
+            cache_key = self._raster_cache_key(svg_data, duration, size, sample_fps)
+            frames = self.raster_cache.load(cache_key)
+            if frames is not None:
+                return frames
+
+        processor = SVGProcessor(svg_string=svg_data, rasterizer=self.rasterizer)
+        frames = await self._svg_frames(processor, duration, fps, max_cached, lazy and not shared, size, sample_fps)
+        if shared:
+            self.sprite_store.put(key, frames)
+            if cache_key is not None:
+                self.raster_cache.store(cache_key, frames)
+        return frames
+
+    def _raster_cache_key(self, svg_data: str, duration: float, size: Tuple[int, int],
+                          sample_fps: Optional[float] = None) -> str:
+        return RasterCache.key(svg_data, duration, self.fps, size,
+                               SVGProcessor.rasterizer_version(rasterizer=self.rasterizer), sample_fps)
+
+    async def warm_sprite_tracks(self, scenes: List[Dict], pool: ProcessPoolExecutor):
+        """
+        Rasterize every sprite track the scenes use into the raster cache,
+        one pool job per distinct track, before their renders fan out to
+        worker processes. Workers then memory-map the tracks, so a character
+        shared by several scenes or segments is rasterized once per run (and
+        not at all once cached). Without the raster cache, or under a memory
+        budget, workers keep rendering their own tracks.
+        """
+        if self.raster_cache is None or self.memory_budget_mb is not None:
+            return
+        jobs = {}
+        for scene_data in scenes:
+            plan = self.load_render_plan(scene_data)
+            for track, svg_data, size in self.sprite_track_sources(scene_data, plan):
+                key = self._raster_cache_key(svg_data, track.duration, size, track.sample_fps)
+                if key not in jobs and not self.raster_cache.contains(key):
+                    jobs[key] = (svg_data, track.duration, size, track.sample_fps)
+        if not jobs:
+            return
+        logger.info(f"Rasterizing {len(jobs)} sprite tracks into the raster cache")
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*(
+            loop.run_in_executor(pool, render_sprite_track, str(self.asset_manager.run_dir), *job,
+                                 self.worker_options())
+            for job in jobs.values()
+        ))
+
+    def total_frames(self, scene_data: Dict) -> int:
+        return RenderPlan.scene_frame_count(scene_data, self.fps)
+
+    def scene_video_path(self, scene_data: Dict) -> Path:
+        """Narrated scenes are encoded with their audio straight into scenes/video_with_sound"""
+        folder = "scenes/video_with_sound" if RenderPlan.audio_path(scene_data) else "scenes/video"
+        return self.asset_manager.get_path(folder, f"scene_{scene_data['scene_id']}.mp4")
+
+    def segment_ranges(self, scene_data: Dict, segments: int) -> List[Tuple[int, int]]:
+        """Split a scene's frames into up to `segments` contiguous [start, end) ranges"""
+        total_frames = self.total_frames(scene_data)
+        min_frames = max(1, int(self.MIN_SEGMENT_SECONDS * self.fps))
+        segments = max(1, min(segments, total_frames // min_frames))
+        bounds = [round(i * total_frames / segments) for i in range(segments + 1)]
+        return [(bounds[i], bounds[i + 1]) for i in range(segments)]
+
+    @staticmethod
+    def segment_path(output_path: Path, index: int) -> Path:
+        return output_path.with_name(f"{output_path.stem}_part{index:03d}{output_path.suffix}")
+
+    async def create_scene_video(self, scene_data: Dict, output_path: Optional[Path] = None,
+                                 segments: int = 1, max_workers: Optional[int] = None) -> Path:
+        """
+        Render the scene video, optionally splitting its frame range into
+        `segments` chunks. Each chunk is rendered and encoded in its own
+        worker process (every encode starts on a keyframe) and the chunks are
+        stitched with the ffmpeg concat demuxer without re-encoding; the
+        scene's audio is muxed in while stitching.
+        """
+        scene_id = scene_data["scene_id"]
+        if output_path is None:
+            output_path = self.scene_video_path(scene_data)
+        output_path = Path(output_path).absolute()
+
+        self.prepare_render_plan(scene_data)
+        ranges = self.segment_ranges(scene_data, segments)
+        if len(ranges) == 1:
+            return await self.render_segment(scene_data, output_path)
+
+        workers = min(max_workers or len(ranges), len(ranges))
+        logger.info(f"Rendering scene {scene_id} as {len(ranges)} segments with {workers} worker processes")
+        loop = asyncio.get_running_loop()
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+            await self.warm_sprite_tracks([scene_data], pool)
+            futures = [
+                loop.run_in_executor(
+                    pool,
+                    render_scene_segment,
+                    str(self.asset_manager.run_dir),
+                    scene_data,
+                    str(self.segment_path(output_path, i)),
+                    start_frame,
+                    end_frame,
+                    self.worker_options()
+                )
+                for i, (start_frame, end_frame) in enumerate(ranges)
+            ]
+            segment_paths = await asyncio.gather(*futures)
+
+        return await self.concat_segments(segment_paths, output_path, RenderPlan.audio_path(scene_data))
+
+    def output_variants(self, output_path) -> List[Path]:
+        """Files a scene encode to output_path writes, one per aspect"""
+        if self.aspects is None:
+            return [Path(output_path)]
+        return [aspect.path(output_path) for aspect in self.aspects]
+
+    async def concat_segments(self, segment_paths: List[str], output_path: Path,
+                              audio_path: Optional[Path] = None) -> str:
         """
-        Render the scene video by:
+        Stitch segment encodes into the scene video, adding the scene's
+        audio, and remove the parts. The aspect variants are stitched
+        concurrently.
+        """
+        variant_parts = [list(parts) for parts in zip(*(self.output_variants(p) for p in segment_paths))]
+        await asyncio.gather(*(
+            VideoEncoder.concat(parts, variant_path, audio_path=audio_path, runner=self.ffmpeg_runner)
+            for variant_path, parts in zip(self.output_variants(output_path), variant_parts)
+        ))
+        for parts in variant_parts:
+            for part in parts:
+                part.unlink(missing_ok=True)
+        return str(output_path)
+
+    def sprite_track_sources(self, scene_data: Dict,
+                             plan: RenderPlan) -> List[Tuple[SpriteTrack, str, Tuple[int, int]]]:
+        """(track, SVG source, raster size) of every sprite track of the plan"""
+        characters_by_name = {c["name"]: c for c in scene_data.get("characters", [])}
+        sources = []
+        for track, max_scale in zip(plan.tracks, plan.max_scales()):
+            char_data = characters_by_name[track.character_name]
+            if track.animation_name is None:
+                svg_data = Path(char_data["base_path"]).read_text(encoding='utf-8')
+            else:
+                svg_data = char_data["animations"][track.animation_name]
+            sources.append((track, svg_data, self.sprite_raster_size(max_scale)))
+        return sources
+
+    def render_plan_path(self, scene_data: Dict) -> Path:
+        return self.asset_manager.get_path("metadata", f"render_plan_scene_{scene_data['scene_id']}.json")
+
+    def prepare_render_plan(self, scene_data: Dict) -> RenderPlan:
+        """Compile the scene's render plan and save it to metadata/ for later renders"""
+        plan = RenderPlan.from_scene_data(scene_data, self.fps)
+        plan_path = self.render_plan_path(scene_data)
+        plan.save(plan_path)
+        scene_data["render_plan_path"] = str(plan_path)
+        return plan
+
+    def load_render_plan(self, scene_data: Dict) -> RenderPlan:
+        """Load a previously saved render plan, compiling a new one if none matches"""
+        plan_path = scene_data.get("render_plan_path")
+        if plan_path and Path(plan_path).exists():
+            plan = RenderPlan.load(Path(plan_path))
+            if plan.fps == self.fps and plan.frame_count == self.total_frames(scene_data):
+                return plan
+            logger.warning(f"Render plan {plan_path} does not match the scene settings, recompiling")
+        return RenderPlan.from_scene_data(scene_data, self.fps)
+
+    @staticmethod
+    def _composite_scene_layer(bg_array: np.ndarray, scene_array: np.ndarray) -> np.ndarray:
+        """Blend a premultiplied RGBA scene frame over a copy of the RGB background"""
+        frame = bg_array.copy()
+        h, w = frame.shape[:2]
+        ch, cw = scene_array.shape[:2]
+
+        x2, y2 = min(w, cw), min(h, ch)
+        blend_over(frame[0:y2,0:x2], scene_array[0:y2,0:x2])
+        return frame
+
+    async def render_segment(self, scene_data: Dict, output_path: Path,
+                             start_frame: int = 0, end_frame: Optional[int] = None) -> Path:
+        """
+        Render frames [start_frame, end_frame) of the scene video by:
         - Rendering the background scene SVG frames.
         - Rendering each character over it based on movements.
         - For each character's animation, derive its natural duration
           from the first movement in scene_movements.json that uses it.
         """
-        scene_id = scene_data["scene_id"]
         duration = scene_data.get("duration", 5.0)
         scene_svg_path = scene_data.get("svg_path", None)
         characters = scene_data.get("characters", [])
 
-        if output_path is None:
-            output_path = self.asset_manager.get_path("scenes/video", f"scene_{scene_id}.mp4")
-
-        output_path = output_path.absolute()
+        output_path = Path(output_path).absolute()
         output_path.parent.mkdir(parents=True, exist_ok=True)
 
         background_path = Path(scene_data["background_path"]).absolute()
@@ -44,168 +338,165 @@ class VideoProcessor:
         with Image.open(background_path) as img:
             if img.mode != 'RGB':
                 img = img.convert('RGB')
+            if self.render_scale != 1:
+                img = img.resize((max(1, round(img.width * self.render_scale)),
+                                  max(1, round(img.height * self.render_scale))), Image.LANCZOS)
             bg_array = np.array(img)
 
-        fps = 30
-        total_frames = int(duration * fps)
+        fps = self.fps
+        frame_size = self.profile.size
+        total_frames = self.total_frames(scene_data)
+        if end_frame is None:
+            end_frame = total_frames
+        # A partial range only touches some sprite frames, so render those on demand
+        lazy = (start_frame, end_frame) != (0, total_frames)
+
+        plan = self.load_render_plan(scene_data)
+
+        # Under a memory budget every track (scene layer and each sprite
+        # track) gets an equal share of the frame cache memory
+        track_count = 1 + len(plan.tracks)
+        max_cached = self._max_cached_frames(track_count, frame_size * frame_size * 4)
+        if max_cached is not None:
+            logger.info(f"Bounded-memory render: {self.memory_budget_mb} MB budget, "
+                        f"up to {max_cached} cached scene frames, shared by {track_count} tracks")
 
         # Render scene background frames if any
         scene_frames = []
         if scene_svg_path:
-            svg_processor = SVGProcessor(Path(scene_svg_path))
-            scene_svg_frames = await svg_processor.generate_frames(duration=duration, fps=fps)
-            scene_frames = scene_svg_frames
-
-        # We need to determine animation durations from movements
-        # For each character, we have a set of movements with animation_name.
-        # We'll find the first movement that uses a given animation_name and use that duration.
-        # If an animation_name appears multiple times with different durations, 
-        # we stick to the first encountered duration.
-
-        # Gather animation durations from movements
-        animation_durations = {}  # { (char_name, anim_name): duration_in_seconds }
-
-        for char_data in characters:
-            char_name = char_data["name"]
-            for m in char_data["movements"]:
-                anim_name = m["animation_name"]
-                if anim_name is not None:
-                    movement_duration = m["end_time"] - m["start_time"]
-                    # If not set yet, record this animation duration
-                    if (char_name, anim_name) not in animation_durations:
-                        animation_durations[(char_name, anim_name)] = movement_duration
-
-        # Pre-generate frames for each character and their animations
-        character_frames_map = {}
-        for char_data in characters:
-            char_name = char_data["name"]
-            base_path = char_data["base_path"]
-            animations = char_data["animations"]
-
-            # Base frames: we consider the base character animation equivalent to the entire scene duration
-            # since it might be a subtle idle animation. If you prefer, you can set a default duration for base.
-            # We'll just keep using scene duration here for base_path for now.
-            base_svg_proc = SVGProcessor(Path(base_path))
-            base_frames = await base_svg_proc.generate_frames(duration=duration, fps=fps)
-            character_frames_map[char_name] = {None: base_frames}
-
-            # Now for each animation, use the calculated duration if available
-            for anim_name, anim_svg in animations.items():
-                # Determine animation duration
-                # If not in animation_durations, default to a 1s duration (or scene duration)
-                # Ideally every animation_name should appear in at least one movement, but let's be safe.
-                anim_duration = animation_durations.get((char_name, anim_name), 1.0)
-
-                anim_path = self.asset_manager.save_animation(char_name, f"{anim_name}_temp", anim_svg)
-                anim_processor = SVGProcessor(Path(anim_path))
-                # Generate frames for this specific animation duration
-                anim_frames = await anim_processor.generate_frames(duration=anim_duration, fps=fps)
-                character_frames_map[char_name][anim_name] = anim_frames
-
-        encoder = VideoEncoder(str(output_path), fps)
-
-        final_frames = []
-        for frame_idx in range(total_frames):
-            current_time = frame_idx / fps
-            frame = bg_array.copy()
-            if frame_idx % 10 == 0:
-                logger.info(f"Processing frame {frame_idx+1}/{total_frames}")
-
-            # Blend scene frame if available
-            if scene_frames:
-                scene_frame = scene_frames[min(frame_idx, len(scene_frames)-1)]
-                scene_img = Image.open(BytesIO(scene_frame)).convert('RGBA')
-                scene_array = np.array(scene_img)
-
-                h, w = frame.shape[:2]
-                ch, cw = scene_array.shape[:2]
-
-                x, y = 0, 0
-                x2, y2 = min(w, cw), min(h, ch)
-                alpha = scene_array[0:y2,0:x2,3:4]/255.0
-                src_rgb = scene_array[0:y2,0:x2,:3]
-                dst_rgb = frame[0:y2,0:x2]
-                blended = (src_rgb*alpha + dst_rgb*(1-alpha)).astype(np.uint8)
-                frame[0:y2,0:x2] = blended
-
-            # Place characters based on current movement
-            for char_data in characters:
-                char_name = char_data["name"]
-                char_movements = char_data["movements"]
-                current_movement = None
-                for m in char_movements:
-                    if m["start_time"] <= current_time <= m["end_time"]:
-                        current_movement = m
-                        break
-
-                if not current_movement:
+            svg_processor = SVGProcessor(Path(scene_svg_path), rasterizer=self.rasterizer)
+            scene_frames = await self._svg_frames(svg_processor, duration, fps, max_cached, lazy,
+                                                  (frame_size, frame_size))
+
+        # Pre-generate frames for every sprite track the plan uses: the base SVG
+        # covers the whole scene (it may carry a subtle idle animation), each
+        # animation the duration of the first movement that uses it. Sprites are
+        # rasterized at the largest size they are drawn at in the whole scene
+        # (not just this segment, so every segment draws identical sprites).
+        # SVGs are parsed from memory, and tracks another scene of the run has
+        # already rendered come from the sprite store.
+        track_frames = []
+        for track, svg_data, size in self.sprite_track_sources(scene_data, plan):
+            track_cached = self._max_cached_frames(track_count, size[0] * size[1] * 4)
+            track_frames.append(await self._sprite_frames(svg_data, track.duration, fps, track_cached, lazy, size,
+                                                          track.sample_fps))
+
+        sprite_cache = self._sprite_cache()
+        # A whole-scene render muxes the audio in its encode; segments get it when stitched
+        audio_path = None if lazy else RenderPlan.audio_path(scene_data)
+        encoder = VideoEncoder(str(output_path), fps, aspects=self.aspects, audio_path=audio_path,
+                               profile=self.profile)
+
+        # Ambient particles are simulated and splatted natively instead of
+        # being rasterized as part of the scene SVG
+        particles = None
+        if scene_data.get("particles"):
+            particles = ParticleSystem.from_spec(scene_data["particles"], bg_array.shape[1], bg_array.shape[0],
+                                                 self.render_scale)
+
+        # Background with the scene layer composited over it. The scene layer
+        # is usually static outside its fade-in, so the composite is rebuilt
+        # only when the layer's rendered source frame changes.
+        base, base_source = bg_array, None
+        scene_composites = 0
+
+        height, width = bg_array.shape[:2]
+        # Frames that show the same scene layer frame and the same sprite
+        # frames at the same sizes and positions as the previous frame are
+        # identical; those are held in the encoder instead of recomposited.
+        # Particles move every frame, so scenes with particles never hold.
+        previous_state = None
+        held_frames = 0
+        with FrameCompositor(self.compositor_threads) as compositor, encoder.stream(width, height) as stream:
+            for frame_idx in range(start_frame, end_frame):
+                if frame_idx % 10 == 0:
+                    logger.info(f"Processing frame {frame_idx+1}/{total_frames}")
+
+                scene_idx = scene_source = None
+                if scene_frames:
+                    scene_idx = min(frame_idx, len(scene_frames)-1)
+                    scene_source = frame_source_index(scene_frames, scene_idx)
+
+                # Characters as laid out by the render plan: (track, source frame, draw size, x, y)
+                sprites = []
+                frame_indices = []
+                for c in range(len(plan.characters)):
+                    track_id = int(plan.track_ids[c, frame_idx])
+                    if track_id < 0:
+                        continue
+                    frame_index = int(plan.frame_indices[c, frame_idx])
+                    scale = plan.scale[c, frame_idx] * self.render_scale
+                    draw_size = SpriteCache.scaled_size(SVGProcessor.OUTPUT_SIZE, SVGProcessor.OUTPUT_SIZE, scale)
+                    # Looping tracks repeat source frames, so identify sprites by the source frame
+                    sprites.append((track_id, frame_source_index(track_frames[track_id], frame_index), draw_size,
+                                    plan.x[c, frame_idx] * self.render_scale, plan.y[c, frame_idx] * self.render_scale))
+                    frame_indices.append(frame_index)
+
+                state = (scene_source, sprites)
+                if particles is None and state == previous_state:
+                    stream.hold()
+                    held_frames += 1
                     continue
+                previous_state = state
+
+                if scene_source is not None and scene_source != base_source:
+                    base = self._composite_scene_layer(bg_array, scene_frames[scene_idx])
+                    base_source = scene_source
+                    scene_composites += 1
+                compositor.begin(base)
+                if particles is not None:
+                    compositor.draw_particles(particles, frame_idx / fps)
+
+                for (track_id, source_index, draw_size, x_pos, y_pos), frame_index in zip(sprites, frame_indices):
+                    track = plan.tracks[track_id]
+                    sprite_key = (track.character_name, track.animation_name, source_index)
+                    char_frame = track_frames[track_id][frame_index]
+                    char_array = sprite_cache.get(sprite_key, char_frame, draw_size)
+                    compositor.draw_centered(char_array, x_pos, y_pos)
+
+                # Hand the raw RGB frame to the encoder; it is encoded while we composite the next one
+                stream.write(compositor.finish())
+
+            if stream.frame_count == 0:
+                raise ValueError("No frames generated")
+
+        logger.info(f"Sprite cache: {sprite_cache.stats()}")
+        logger.info(f"Sprite store: {self.sprite_store.stats()}")
+        if self.raster_cache is not None:
+            logger.info(f"Raster cache: {self.raster_cache.stats()}")
+        logger.info(f"Compositor: {compositor.stats()}")
+        if scene_frames:
+            logger.info(f"Scene layer composited {scene_composites} times for {end_frame - start_frame} frames")
+        logger.info(f"Held {held_frames} of {end_frame - start_frame} frames unchanged from the previous frame")
+
+        video_path = encoder.output_path
+        for variant_path in encoder.output_paths:
+            if not variant_path.exists() or variant_path.stat().st_size == 0:
+                raise RuntimeError(f"Generated video file is empty or not created: {variant_path}")
 
-                anim_name = current_movement["animation_name"]
-                frames = character_frames_map[char_name].get(anim_name, character_frames_map[char_name][None])
-                if not frames:
-                    continue
+        return video_path
 
-                movement_duration = current_movement["end_time"] - current_movement["start_time"]
-                if movement_duration <= 0:
-                    movement_duration = 0.001
-                t = (current_time - current_movement["start_time"]) / movement_duration
-                t = max(0.0, min(t, 1.0))
-
-                # t maps 0->start_time to 1->end_time of that movement
-                # frames for this animation were generated according to the movement's animation duration
-                # so t directly maps to the frames of that animation
-                char_frame_idx = int(t * (len(frames)-1))
-                char_frame = frames[char_frame_idx]
-
-                # Determine character position and scale
-                sx, sy = current_movement["start_position"]
-                ex, ey = current_movement["end_position"]
-                x_pos = sx + (ex - sx)*t
-                y_pos = sy + (ey - sy)*t
-
-                s_scale = current_movement["start_scale"]
-                e_scale = current_movement["end_scale"]
-                scale = s_scale + (e_scale - s_scale)*t
-
-                char_img = Image.open(BytesIO(char_frame)).convert('RGBA')
-                if scale != 1.0:
-                    new_w = int(char_img.width * scale)
-                    new_h = int(char_img.height * scale)
-                    char_img = char_img.resize((new_w, new_h), Image.LANCZOS)
-
-                char_array = np.array(char_img)
-                ch, cw = char_array.shape[:2]
-
-                x = int(x_pos - cw/2)
-                y = int(y_pos - ch/2)
-
-                x1, y1 = max(0, x), max(0, y)
-                x2, y2 = min(frame.shape[1], x+cw), min(frame.shape[0], y+ch)
-
-                src_x1 = max(0, -x)
-                src_y1 = max(0, -y)
-                src_x2 = src_x1 + (x2 - x1)
-                src_y2 = src_y1 + (y2 - y1)
-
-                if (x2 > x1 and y2 > y1 and src_x2 > src_x1 and src_y2 > src_y1 and
-                    src_y2 <= ch and src_x2 <= cw):
-                    alpha = char_array[src_y1:src_y2, src_x1:src_x2, 3:4]/255.0
-                    src_rgb = char_array[src_y1:src_y2, src_x1:src_x2,:3]
-                    dst_rgb = frame[y1:y2, x1:x2]
-                    blended = (src_rgb*alpha + dst_rgb*(1-alpha)).astype(np.uint8)
-                    frame[y1:y2, x1:x2] = blended
-
-            frame_img = Image.fromarray(frame)
-            with BytesIO() as bio:
-                frame_img.save(bio, format='PNG')
-                final_frames.append(bio.getvalue())
-
-        if not final_frames:
-            raise ValueError("No frames generated")
-
-        video_path = encoder.encode_frames(final_frames)
-        if not output_path.exists() or output_path.stat().st_size == 0:
-            raise RuntimeError("Generated video file is empty or not created")
 
-        return video_path
+def render_scene_segment(run_dir: str, scene_data: Dict, output_path: str,
+                         start_frame: int = 0, end_frame: Optional[int] = None,
+                         options: Optional[Dict] = None) -> str:
+    """
+    Process-pool entry point: render a scene, or a frame range of it,
+    inside a worker process.
+
+    Only plain, picklable arguments cross the process boundary; the worker
+    reopens the run directory with its own AssetManager. `options` are the
+    parent's VideoProcessor.worker_options().
+    """
+    asset_manager = AssetManager(base_dir=str(Path(run_dir).parent), run_dir=run_dir)
+    processor = VideoProcessor(asset_manager, **(options or {}))
+    video_path = asyncio.run(processor.render_segment(scene_data, Path(output_path), start_frame, end_frame))
+    return str(video_path)
+
+
+def render_sprite_track(run_dir: str, svg_data: str, duration: float, size: Tuple[int, int],
+                        sample_fps: Optional[float] = None, options: Optional[Dict] = None):
+    """Process-pool entry point: rasterize a whole sprite track into the raster cache"""
+    asset_manager = AssetManager(base_dir=str(Path(run_dir).parent), run_dir=run_dir)
+    processor = VideoProcessor(asset_manager, **(options or {}))
+    asyncio.run(processor._sprite_frames(svg_data, duration, processor.fps, None, False, tuple(size), sample_fps))